@@ -0,0 +1 @@
+"""Benchmarks de rendimiento (se ejecutan a mano, no forman parte de la app)."""
@@ -0,0 +1,79 @@
+"""Benchmark: latencia del event loop durante una avalancha de logins.
+
+Lanza N verificaciones de contraseña concurrentes mientras una tarea mide
+cuánto se retrasa un tick periódico del event loop (lo que notaría un
+stream de tokens en ese momento). Compara bcrypt síncrono en el loop con
+la API asíncrona (pool acotado) y con la caché de verificaciones.
+
+Uso:
+    python -m benchmarks.bench_auth --logins 50 --users 10
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from src.auth import utils
+from src.auth.utils import averify_password, get_password_hash, verify_password
+
+TICK = 0.005  # 5 ms
+
+
+async def _measure_lag(stop: asyncio.Event, samples: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        samples.append((time.perf_counter() - start - TICK) * 1000)
+
+
+async def _storm(verify, credentials: list):
+    async def login(password, hashed):
+        # Cede el control una vez, como haría el callback real tras leer la DB
+        await asyncio.sleep(0)
+        return await verify(password, hashed)
+
+    await asyncio.gather(*(login(p, h) for p, h in credentials))
+
+
+async def _run_scenario(name: str, verify, credentials: list):
+    samples = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(_measure_lag(stop, samples))
+    await asyncio.sleep(TICK * 2)
+
+    start = time.perf_counter()
+    await _storm(verify, credentials)
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await ticker
+    samples.sort()
+    p99 = samples[int(len(samples) * 0.99) - 1] if samples else 0.0
+    print(
+        f"{name:<22} total={elapsed:6.2f}s  ticks={len(samples):5d}  "
+        f"lag p50={statistics.median(samples) if samples else 0:7.1f}ms  "
+        f"p99={p99:7.1f}ms  max={max(samples, default=0):7.1f}ms"
+    )
+
+
+async def main(logins: int, users: int):
+    hashes = [(f"password-{i}", get_password_hash(f"password-{i}")) for i in range(users)]
+    credentials = [hashes[i % users] for i in range(logins)]
+
+    async def sync_verify(password, hashed):
+        return verify_password(password, hashed)
+
+    await _run_scenario("bcrypt en el loop", sync_verify, credentials)
+    utils._verify_cache.clear()
+    await _run_scenario("pool (caché fría)", averify_password, credentials)
+    await _run_scenario("pool (caché caliente)", averify_password, credentials)
+    print(f"caché de verificaciones: {utils._verify_cache.stats()}")
+    utils.shutdown_hash_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=50, help="logins concurrentes")
+    parser.add_argument("--users", type=int, default=10, help="usuarios distintos")
+    args = parser.parse_args()
+    asyncio.run(main(args.logins, args.users))
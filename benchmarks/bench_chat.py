@@ -0,0 +1,151 @@
+"""Benchmark de extremo a extremo: usuarios concurrentes contra el handler de chat.
+
+Arranca el proveedor falso (benchmarks.mock_provider), apunta Ollama a él y
+ejecuta el handler real de Chainlit (on_chat_start + on_message) para N
+usuarios simultáneos, con un emisor que en vez de un websocket registra
+cuándo llega cada frame. Informa de percentiles de TTFT (desde que entra el
+mensaje hasta el primer frame al cliente), duración y throughput.
+
+Uso:
+    python -m benchmarks.bench_chat --users 50 --messages 3 --latency-ms 300 --rate 40
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from benchmarks.common import report, summarize, use_database
+from benchmarks.mock_provider import MockProviderConfig, serve_in_background
+
+
+async def run(args):
+    # Imports tardíos: el entorno (DB, URL de Ollama) ya está configurado
+    import chainlit as cl
+    import chainlit.data as cl_data
+    from chainlit.context import ChainlitContext, context_var
+    from chainlit.emitter import BaseChainlitEmitter
+    from chainlit.session import HTTPSession
+    import src.app as chat_app
+    from src.db.chainlit_data_layer import CustomDataLayer
+    from src.db.database import async_session, dispose_engines, engine
+    from src.db.migrations import run_migrations
+    from src.db.models import User
+    from src.db.write_queue import persistence_queue
+    from src.services.client_registry import client_registry
+    from src.services.llm_service import llm_service
+
+    class RecordingEmitter(BaseChainlitEmitter):
+        """Emisor sin websocket: apunta el instante de cada frame de tokens."""
+
+        def __init__(self, session):
+            super().__init__(session)
+            self.frames = []
+
+        async def stream_start(self, step_dict):
+            # El primer frame de un mensaje no pasa por send_token: llega aquí con el texto
+            self.frames.append((time.perf_counter(), len(step_dict["output"])))
+
+        async def send_token(self, id: str, token: str, is_sequence=False, is_input=False):
+            self.frames.append((time.perf_counter(), len(token)))
+
+        def set_chat_settings(self, settings: dict):
+            # ChatSettings.send() lo llama sin await (el emisor real es síncrono aquí)
+            pass
+
+    cl_data._data_layer = CustomDataLayer()
+    async with engine.begin() as conn:
+        await conn.run_sync(run_migrations)
+    async with async_session() as session:
+        users = [User(email=f"bench{i}@example.com", hashed_password="x") for i in range(args.users)]
+        session.add_all(users)
+        await session.commit()
+    persistence_queue.start()
+
+    ttft, durations, rates, errors = [], [], [], 0
+    frames_total = chars_total = 0
+
+    async def simulate_user(user_row):
+        nonlocal errors, frames_total, chars_total
+        user = cl.User(identifier=user_row.email, id=str(user_row.id), metadata={"id": user_row.id})
+        session = HTTPSession(id=f"bench-{user_row.id}", client_type="webapp", user=user)
+        emitter = RecordingEmitter(session)
+        context_var.set(ChainlitContext(session, emitter))
+        cl.user_session.set("user", user)
+
+        await chat_app.start()
+        cl.user_session.set("chat_settings", {"ModelProvider": "ollama", "OllamaModel": args.model, "ModelName": ""})
+
+        for i in range(args.messages):
+            emitter.frames.clear()
+            start = time.perf_counter()
+            await chat_app.main(cl.Message(content=f"Pregunta {i} del usuario {user_row.id}"))
+            end = time.perf_counter()
+            if not emitter.frames:
+                errors += 1
+                continue
+            first_frame = emitter.frames[0][0]
+            chars = sum(size for _, size in emitter.frames)
+            ttft.append(first_frame - start)
+            durations.append(end - start)
+            if end > first_frame:
+                rates.append(args.tokens / (end - first_frame))
+            frames_total += len(emitter.frames)
+            chars_total += chars
+            if args.think_ms:
+                await asyncio.sleep(args.think_ms / 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate_user(u) for u in users))
+    elapsed = time.perf_counter() - started
+
+    print(f"{args.users} usuarios x {args.messages} mensajes en {elapsed:.2f}s (errores: {errors})")
+    report("TTFT (mensaje -> primer frame)", ttft)
+    report("duración de la respuesta", durations)
+    report("tokens/s por stream", rates, unit="", scale=1.0)
+    completed = summarize(durations)["n"]
+    print(f"{'throughput agregado':<32} {completed * args.tokens / elapsed:,.0f} tokens/s, "
+          f"{completed / elapsed:,.1f} respuestas/s")
+    if frames_total:
+        print(f"{'frames al cliente':<32} {frames_total:,} ({chars_total / frames_total:.1f} caracteres/frame)")
+    print(f"scheduler: {chat_app.stream_scheduler.stats()}")
+    print(f"backends: {llm_service.stats()}")
+
+    await persistence_queue.stop()
+    await client_registry.aclose()
+    await dispose_engines()
+
+
+async def main(args):
+    mock_config = MockProviderConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        tokens_per_second=args.rate,
+        tokens=args.tokens,
+        error_rate=args.error_rate,
+        models=[args.model],
+    )
+    async with serve_in_background(mock_config, port=args.port) as base_url:
+        os.environ["OLLAMA_BASE_URLS"] = base_url
+        await run(args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20, help="usuarios simultáneos")
+    parser.add_argument("--messages", type=int, default=3, help="mensajes por usuario")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="pausa entre mensajes del mismo usuario")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="TTFT del proveedor falso")
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--rate", type=float, default=50.0, help="tokens/s por stream del proveedor falso")
+    parser.add_argument("--tokens", type=int, default=100, help="tokens por respuesta")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--model", default="llama3")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--db", default=None, help="fichero SQLite (por defecto, uno temporal)")
+    args = parser.parse_args()
+
+    use_database(args.db or os.path.join(tempfile.mkdtemp(prefix="bench_chat_"), "chat.db"))
+    # Se mide la app, no la caché de respuestas
+    os.environ["LLM_CACHE_ENABLED"] = "false"
+    asyncio.run(main(args))
@@ -0,0 +1,258 @@
+"""Benchmark: data layer sobre una base SQLite grande.
+
+Siembra (una vez) una base con muchos usuarios, conversaciones y mensajes y
+mide las operaciones que más pesan en producción:
+  - list_threads: primera página, páginas profundas (cursor) y búsqueda (FTS5)
+  - get_thread: conversación completa (caché de hilos fría y caliente)
+  - add_message: commit por mensaje (crud) frente a la cola de escritura
+
+Uso:
+    python -m benchmarks.bench_data_layer --db /tmp/bench.db \\
+        --conversations 100000 --messages 2000000 --samples 200
+
+La siembra se reutiliza si la base ya tiene los datos pedidos (--reseed para rehacerla).
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from itertools import accumulate
+from benchmarks.common import report, use_database
+
+SEED_BATCH = 50_000
+BASE_DATE = datetime(2024, 1, 1)
+WORDS = "hola modelo respuesta python datos consulta streaming índice sqlite caché usuario token".split()
+# Vocabulario con frecuencias tipo Zipf: unas pocas palabras muy comunes y una cola larga
+VOCABULARY = WORDS + [f"termino{i}" for i in range(5000)]
+VOCABULARY_CUM_WEIGHTS = list(accumulate(1 / (rank + 1) for rank in range(len(VOCABULARY))))
+
+
+def _timestamp(seconds: float) -> str:
+    # Mismo formato que guarda SQLAlchemy para DateTime en SQLite
+    return (BASE_DATE + timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def _existing_counts(path: str):
+    if not os.path.exists(path):
+        return None
+    conn = sqlite3.connect(path)
+    try:
+        return tuple(conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in ("users", "conversations", "messages"))
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.close()
+
+
+def seed(path: str, users: int, conversations: int, messages: int, rng: random.Random):
+    """Inserta los datos con sqlite3 directo: millones de filas en segundos, no en minutos."""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    # Las contraseñas no se usan en este benchmark
+    conn.executemany(
+        "INSERT INTO users (id, email, hashed_password, created_at) VALUES (?, ?, ?, ?)",
+        ((i, f"bench{i}@example.com", "x", _timestamp(0)) for i in range(1, users + 1)),
+    )
+
+    # Conversaciones repartidas entre usuarios, en orden cronológico
+    span = 365 * 24 * 3600
+    conv_times = sorted(rng.uniform(0, span) for _ in range(conversations))
+    rows = [(i + 1, f"Conversación {i + 1} " + rng.choice(WORDS), rng.randint(1, users), _timestamp(t))
+            for i, t in enumerate(conv_times)]
+    conn.executemany("INSERT INTO conversations (id, title, user_id, created_at) VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+
+    # Mensajes: reparto sesgado (unas pocas conversaciones muy largas, como en la realidad)
+    weights = [rng.paretovariate(1.2) for _ in range(conversations)]
+    targets = rng.choices(range(conversations), weights=weights, k=messages)
+    offsets = [0] * conversations
+    batch = []
+    for n, c in enumerate(targets, start=1):
+        offsets[c] += 1
+        batch.append((
+            c + 1,
+            "user" if offsets[c] % 2 else "assistant",
+            " ".join(rng.choices(VOCABULARY, cum_weights=VOCABULARY_CUM_WEIGHTS, k=rng.randint(5, 40))),
+            _timestamp(conv_times[c] + offsets[c]),
+        ))
+        if len(batch) >= SEED_BATCH:
+            conn.executemany("INSERT INTO messages (conversation_id, role, content, created_at) VALUES (?, ?, ?, ?)", batch)
+            conn.commit()
+            batch.clear()
+            print(f"\r  mensajes: {n:,}/{messages:,}", end="", flush=True)
+    if batch:
+        conn.executemany("INSERT INTO messages (conversation_id, role, content, created_at) VALUES (?, ?, ?, ?)", batch)
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    print()
+
+
+async def check_pagination(data_layer):
+    """
+    Recorre la barra lateral de un usuario nuevo cuyas conversaciones tienen la fecha
+    de server_default (sin microsegundos, todas en el mismo segundo) y borra la del
+    cursor entre páginas. La siembra usa otro formato de fecha y no lo detectaría.
+    """
+    from chainlit.types import Pagination, ThreadFilter
+    from sqlalchemy import delete
+    from src.db.database import async_session
+    from src.db.models import Conversation, User
+
+    async with async_session() as session:
+        user = User(email="bench-paginacion@example.com", hashed_password="x")
+        session.add(user)
+        await session.flush()
+        conversations = [Conversation(title=f"Paginación {i}", user_id=user.id) for i in range(7)]
+        session.add_all(conversations)
+        await session.commit()
+        user_id = user.id
+        expected = sorted((c.id for c in conversations), reverse=True)
+
+    try:
+        seen, cursor = [], None
+        for _ in range(len(expected) + 1):
+            page = await data_layer.list_threads(Pagination(first=3, cursor=cursor), ThreadFilter(userId=str(user_id)))
+            seen += [int(thread["id"]) for thread in page.data]
+            if not page.pageInfo.hasNextPage:
+                break
+            cursor = page.pageInfo.endCursor
+            if len(seen) == 3:
+                # La conversación del cursor desaparece entre una página y la siguiente
+                async with async_session() as session:
+                    await session.execute(delete(Conversation).filter(Conversation.id == seen[-1]))
+                    await session.commit()
+        if seen != expected:
+            raise SystemExit(f"list_threads pagina mal: {seen} en lugar de {expected}")
+    finally:
+        async with async_session() as session:
+            await session.execute(delete(Conversation).filter(Conversation.user_id == user_id))
+            await session.execute(delete(User).filter(User.id == user_id))
+            await session.commit()
+
+
+async def _timeit(samples: list, coro):
+    start = time.perf_counter()
+    result = await coro
+    samples.append(time.perf_counter() - start)
+    return result
+
+
+async def run(args):
+    # Imports tardíos: settings.DATABASE_URL ya apunta a la base del benchmark
+    from chainlit.types import Pagination, ThreadFilter
+    from src.db import crud, identity_cache
+    from src.db.chainlit_data_layer import CustomDataLayer
+    from src.db.database import Base, async_session, dispose_engines, engine
+    from src.db.migrations import run_migrations
+    from src.db.models import create_missing_indexes
+    from src.db.write_queue import persistence_queue
+
+    rng = random.Random(args.seed)
+    expected = (args.users, args.conversations, args.messages)
+    if args.reseed and os.path.exists(args.db):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(create_missing_indexes)
+
+    counts = _existing_counts(args.db)
+    # Cada ejecución añade algunos mensajes (add_message): se admiten de más
+    reusable = counts is not None and counts[:2] == expected[:2] and counts[2] >= expected[2]
+    if not reusable:
+        if counts and any(counts):
+            raise SystemExit(f"La base {args.db} tiene otros datos {counts}; usa --reseed")
+        print(f"Sembrando {args.users:,} usuarios, {args.conversations:,} conversaciones, {args.messages:,} mensajes...")
+        start = time.perf_counter()
+        await asyncio.to_thread(seed, args.db, *expected, rng)
+        print(f"  siembra: {time.perf_counter() - start:.1f}s")
+
+    # Después de sembrar, el esquema completo (como al arrancar la app): un índice FTS
+    # nuevo se construye de una vez, más rápido que con triggers durante la siembra
+    start = time.perf_counter()
+    async with engine.begin() as conn:
+        migrated = await conn.run_sync(run_migrations)
+    print(f"  migraciones {migrated['applied'] or 'ninguna'}: {time.perf_counter() - start:.1f}s")
+
+    data_layer = CustomDataLayer()
+    user_ids = [rng.randint(1, args.users) for _ in range(args.samples)]
+    conv_ids = [rng.randint(1, args.conversations) for _ in range(args.samples)]
+    persistence_queue.start()
+    await check_pagination(data_layer)
+
+    # --- list_threads ---
+    first_page, deep_page, search = [], [], []
+    for user_id in user_ids:
+        user_filter = ThreadFilter(userId=str(user_id))
+        page = await _timeit(first_page, data_layer.list_threads(Pagination(first=20), user_filter))
+        cursor = page.pageInfo.endCursor
+        # Páginas 2..N: con OFFSET cada una sería más lenta; con keyset deberían costar lo mismo
+        for _ in range(args.deep_pages):
+            if not cursor:
+                break
+            page = await _timeit(deep_page, data_layer.list_threads(Pagination(first=20, cursor=cursor), user_filter))
+            cursor = page.pageInfo.endCursor
+        # Términos de frecuencia media: ni el peor caso (en todos los mensajes) ni sin resultados
+        await _timeit(search, data_layer.list_threads(
+            Pagination(first=20), ThreadFilter(userId=str(user_id), search=rng.choice(VOCABULARY[20:500]))
+        ))
+    report("list_threads (primera página)", first_page)
+    report("list_threads (páginas siguientes)", deep_page)
+    report("list_threads (búsqueda)", search)
+
+    # --- get_thread ---
+    cold, warm = [], []
+    for conv_id in conv_ids:
+        identity_cache.thread_cache.clear()
+        await _timeit(cold, data_layer.get_thread(str(conv_id)))
+        await _timeit(warm, data_layer.get_thread(str(conv_id)))
+    report("get_thread (caché fría)", cold)
+    report("get_thread (caché caliente)", warm)
+
+    # --- add_message ---
+    direct = []
+    for conv_id in conv_ids:
+        async with async_session() as session:
+            await _timeit(direct, crud.add_message(session, conv_id, "user", "mensaje de benchmark"))
+    report("add_message (commit por mensaje)", direct)
+
+    # Cola de escritura: latencia hasta que el mensaje es durable, con todos los mensajes a la vez
+    queued = []
+
+    async def enqueue_and_wait(conv_id):
+        start = time.perf_counter()
+        persistence_queue.add_message(conv_id, "user", "mensaje de benchmark")
+        await persistence_queue.wait_for(conv_id)
+        queued.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(enqueue_and_wait(c) for c in conv_ids))
+    elapsed = time.perf_counter() - start
+    report("add_message (cola, hasta durable)", queued)
+    print(f"{'add_message (cola) throughput':<32} {len(conv_ids) / elapsed:,.0f} mensajes/s")
+
+    await persistence_queue.stop()
+    await dispose_engines()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default="bench_data_layer.db", help="fichero SQLite del benchmark")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--conversations", type=int, default=100_000)
+    parser.add_argument("--messages", type=int, default=2_000_000)
+    parser.add_argument("--samples", type=int, default=200, help="operaciones medidas por tipo")
+    parser.add_argument("--deep-pages", type=int, default=5, help="páginas seguidas por usuario")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reseed", action="store_true", help="borra la base y la vuelve a sembrar")
+    args = parser.parse_args()
+    use_database(args.db)
+    asyncio.run(run(args))
@@ -0,0 +1,43 @@
+"""Utilidades compartidas por los benchmarks: percentiles e informe."""
+
+import os
+import statistics
+
+
+def use_database(path: str):
+    """
+    Apunta la app a una base de datos SQLite concreta.
+    Debe llamarse ANTES de importar nada de 'src' (settings se lee al importar).
+    """
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.abspath(path)}"
+    # Obligatorio en settings; sin .env el benchmark usa uno de prueba
+    os.environ.setdefault("CHAINLIT_AUTH_SECRET", "benchmark")
+
+
+def percentile(sorted_samples: list, p: float) -> float:
+    """Percentil por el método del rango más cercano (muestras ya ordenadas)."""
+    if not sorted_samples:
+        return 0.0
+    index = max(0, min(len(sorted_samples) - 1, int(round(p / 100 * len(sorted_samples))) - 1))
+    return sorted_samples[index]
+
+
+def summarize(samples: list) -> dict:
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "mean": statistics.fmean(ordered) if ordered else 0.0,
+        "p50": percentile(ordered, 50),
+        "p95": percentile(ordered, 95),
+        "p99": percentile(ordered, 99),
+        "max": ordered[-1] if ordered else 0.0,
+    }
+
+
+def report(name: str, samples: list, unit: str = "ms", scale: float = 1000.0):
+    """Imprime una línea con n, media y percentiles. 'samples' va en segundos (o en la unidad base)."""
+    s = summarize([x * scale for x in samples])
+    print(
+        f"{name:<32} n={s['n']:6d}  mean={s['mean']:9.2f}{unit}  p50={s['p50']:9.2f}{unit}  "
+        f"p95={s['p95']:9.2f}{unit}  p99={s['p99']:9.2f}{unit}  max={s['max']:9.2f}{unit}"
+    )
@@ -0,0 +1,149 @@
+"""Proveedor LLM falso compatible con OpenAI (y con lo que usamos de Ollama).
+
+Sirve /v1/models y /v1/chat/completions (con y sin stream), además de
+/api/tags y /api/generate para el catálogo y la precarga de Ollama. Los
+tokens salen con una latencia inicial y un ritmo configurables, así se
+puede medir la app sin GPU ni claves de API.
+
+Uso (servidor suelto; apunta OLLAMA_BASE_URLS u OPENAI_BASE_URL a él):
+    python -m benchmarks.mock_provider --port 11500 --latency-ms 300 --rate 40 --tokens 200
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from contextlib import asynccontextmanager
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+class MockProviderConfig:
+    def __init__(
+        self,
+        latency_ms: float = 200.0,
+        jitter_ms: float = 0.0,
+        tokens_per_second: float = 50.0,
+        tokens: int = 100,
+        error_rate: float = 0.0,
+        models: list = None,
+    ):
+        self.latency_ms = latency_ms            # Tiempo hasta el primer token
+        self.jitter_ms = jitter_ms              # Variación aleatoria de esa latencia
+        self.tokens_per_second = tokens_per_second  # 0 = sin límite
+        self.tokens = tokens                    # Tokens por respuesta
+        self.error_rate = error_rate            # Fracción de peticiones que devuelven 503
+        self.models = models or ["llama3", "mistral", "gpt-3.5-turbo"]
+
+
+def create_app(config: MockProviderConfig) -> FastAPI:
+    app = FastAPI(title="Mock LLM provider")
+    app.state.requests = 0
+
+    def _chunk(completion_id: str, model: str, delta: dict, finish_reason=None) -> str:
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(payload)}\n\n"
+
+    async def _first_token_delay():
+        delay = config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)
+        await asyncio.sleep(max(0.0, delay) / 1000)
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": m, "object": "model", "owned_by": "mock"} for m in config.models]}
+
+    @app.get("/api/tags")
+    async def ollama_tags():
+        return {"models": [{"name": m} for m in config.models]}
+
+    @app.post("/api/generate")
+    async def ollama_generate():
+        # Precarga de Ollama: basta con contestar
+        return {"done": True}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        app.state.requests += 1
+        body = await request.json()
+        model = body.get("model", "mock")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+        if config.error_rate and random.random() < config.error_rate:
+            return JSONResponse({"error": {"message": "mock overloaded"}}, status_code=503)
+
+        if not body.get("stream"):
+            await _first_token_delay()
+            content = " ".join(f"tok{i}" for i in range(config.tokens))
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            }
+
+        async def events():
+            await _first_token_delay()
+            yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+            interval = 1 / config.tokens_per_second if config.tokens_per_second > 0 else 0
+            started = time.perf_counter()
+            for i in range(config.tokens):
+                if interval:
+                    # Ritmo constante respecto al inicio (sin acumular deriva de sleep)
+                    wait = started + i * interval - time.perf_counter()
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                yield _chunk(completion_id, model, {"content": f"tok{i} "})
+            yield _chunk(completion_id, model, {}, finish_reason="stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+@asynccontextmanager
+async def serve_in_background(config: MockProviderConfig, host: str = "127.0.0.1", port: int = 11500):
+    """Arranca el proveedor falso en este mismo event loop mientras dura el bloque."""
+    server = uvicorn.Server(uvicorn.Config(create_app(config), host=host, port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            # No arrancó (p. ej. puerto ocupado): se propaga el error
+            await task
+            raise RuntimeError(f"El proveedor falso no pudo arrancar en {host}:{port}")
+        await asyncio.sleep(0.01)
+    try:
+        yield f"http://{host}:{port}/v1"
+    finally:
+        server.should_exit = True
+        await task
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="tiempo hasta el primer token")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="variación de la latencia")
+    parser.add_argument("--rate", type=float, default=50.0, help="tokens por segundo (0 = sin límite)")
+    parser.add_argument("--tokens", type=int, default=100, help="tokens por respuesta")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fracción de respuestas 503")
+    args = parser.parse_args()
+    mock_config = MockProviderConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        tokens_per_second=args.rate,
+        tokens=args.tokens,
+        error_rate=args.error_rate,
+    )
+    uvicorn.run(create_app(mock_config), host=args.host, port=args.port, log_level="warning")
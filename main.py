@@ -1,32 +1,107 @@
+from src.startup import startup_report
 from fastapi import FastAPI
 from fastapi.responses import RedirectResponse # <--- Importamos esto para redirigir
+from fastapi.responses import JSONResponse, PlainTextResponse
 from contextlib import asynccontextmanager
+startup_report.mark("import fastapi")
 from chainlit.utils import mount_chainlit
+import chainlit.data as cl_data
+startup_report.mark("import chainlit")
 from src.config import settings
-from src.db.database import engine, Base
-from src.routers import users
-import src.db.models 
+from src.db.database import engine, dispose_engines, check_connection
+from src.db.migrations import run_migrations
 from src.db.chainlit_data_layer import CustomDataLayer
-import chainlit.data as cl_data
+from src.db.write_queue import persistence_queue
+from src.db.archive import archive_job
+from src.db import identity_cache
+startup_report.mark("import db")
+# Los SDK de los proveedores (openai) se importan con el primer cliente, no aquí
+from src.services.client_registry import client_registry
+from src.auth.utils import shutdown_hash_pool
+from src.services.response_cache import response_cache
+from src.services.ollama_service import ollama_catalog
+from src.services.llm_service import llm_service
+from src.services.scheduler import stream_scheduler
+from src.services.shared_state import shared_state
+from src import metrics
+startup_report.mark("import services")
+from src.routers import users, search, elements, transfer, threads
+startup_report.mark("import routers")
 
 # --- LIFESPAN (Ciclo de vida) ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Crear tablas en la base de datos
+    startup_report.mark("servidor (uvicorn)")
+    # Esquema: si la versión está al día no se ejecuta DDL; si no, solo las migraciones pendientes
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        schema = await conn.run_sync(run_migrations)
+    if schema["applied"]:
+        print(f"Esquema migrado de v{schema['from']} a v{schema['to']}: {', '.join(schema['applied'])}")
+    startup_report.mark(f"esquema (v{schema['to']})")
+    persistence_queue.start()
+    # Invalidaciones de caché entre workers
+    shared_state.start()
+    # Catálogo de Ollama en segundo plano y precarga de modelos
+    ollama_catalog.start()
+    # Sondeo de salud de los backends LLM
+    llm_service.start()
+    # Archivo periódico de conversaciones inactivas (si ARCHIVE_AFTER_DAYS > 0)
+    archive_job.start()
+    startup_report.mark("servicios")
+    startup_report.finish()
     yield
+    await archive_job.stop()
+    await llm_service.stop()
+    await ollama_catalog.stop()
+    # Volcar las escrituras pendientes antes de cerrar la DB
+    await persistence_queue.stop()
+    await shared_state.stop()
     # Cerrar conexiones al apagar
-    await engine.dispose()
+    await client_registry.aclose()
+    response_cache.close()
+    shutdown_hash_pool()
+    await dispose_engines()
 
 # Iniciamos FastAPI
 app = FastAPI(title=settings.APP_NAME, lifespan=lifespan)
 app.include_router(users.router, prefix="/api", tags=["Users"]) 
+app.include_router(search.router, prefix="/api", tags=["Search"])
+app.include_router(elements.router, prefix="/api", tags=["Elements"])
+app.include_router(transfer.router, prefix="/api", tags=["Transfer"])
+app.include_router(threads.router, prefix="/api", tags=["Threads"])
 
-# Endpoint de estado
+# Endpoint de estado: comprueba de verdad la DB; los proveedores, según el último sondeo
 @app.get("/api/status")
-def read_root():
-    return {"status": "ok", "app": settings.APP_NAME, "db": "connected"}
+async def read_root():
+    db_ok = await check_connection()
+    providers = llm_service.check_backends()
+    if not db_ok:
+        status = "error"
+    elif any(p["monitored"] and p["last_probe_at"] and p["reachable"] == 0 for p in providers.values()):
+        status = "degraded"
+    else:
+        status = "ok"
+    body = {
+        "status": status,
+        "app": settings.APP_NAME,
+        "db": "connected" if db_ok else "unreachable",
+        "providers": providers,
+        "llm_pool": client_registry.stats(),
+        "llm_backends": llm_service.stats(),
+        "llm_scheduler": stream_scheduler.stats(),
+        "identity_cache": identity_cache.stats(),
+        "llm_cache": response_cache.stats(),
+        "shared_state": shared_state.stats(),
+        "startup": startup_report.stats(),
+        "archive": archive_job.stats(),
+    }
+    # Sin DB la app no sirve: 503 para que el balanceador la saque de rotación
+    return JSONResponse(body, status_code=200 if db_ok else 503)
+
+# Métricas para Prometheus
+@app.get("/api/metrics")
+def read_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 # --- NUEVO: REDIRECCIÓN DE RAÍZ ---
 # Si el usuario entra a http://localhost:8000/, lo mandamos directo al chat
@@ -40,7 +115,15 @@ cl_data._data_layer = CustomDataLayer()
 
 # --- Montar Chainlit ---
 mount_chainlit(app=app, target="src/app.py", path="/chat")
+startup_report.mark("app y montaje de chainlit")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    # Varios workers (WEB_CONCURRENCY) necesitan SHARED_STATE_BACKEND=sqlite; reload solo con uno
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=settings.WEB_CONCURRENCY,
+        reload=settings.WEB_CONCURRENCY == 1,
+    )
\ No newline at end of file
@@ -1,10 +1,17 @@
+import asyncio
+from contextlib import aclosing
 import chainlit as cl
-from sqlalchemy.future import select
 from src.db.database import async_session
-from src.db.models import User
-from src.auth.utils import verify_password
+from src.db.identity_cache import get_user_by_email
+from src.auth.utils import averify_password
 from src.services.llm_service import llm_service
-from src.db.crud import create_conversation, add_message
+from src.services.token_coalescer import TokenCoalescer
+from src.services.context_cache import context_cache
+from src.services.ollama_service import ollama_catalog
+from src.services.scheduler import stream_scheduler, QueueFullError
+from src.db.crud import create_conversation
+from src.db.write_queue import persistence_queue
+from src.services.shared_state import shared_state
 
 # --- CALLBACK DE AUTENTICACIÓN ---
 @cl.password_auth_callback
@@ -13,56 +20,84 @@ async def auth(username: str, password: str):
     Esta función se llama cuando el usuario intenta loguearse en la UI.
     Devuelve cl.User si es correcto, o None si falla.
     """
-    async with async_session() as session:
-        # Buscamos al usuario por email
-        result = await session.execute(select(User).filter(User.email == username))
-        user_db = result.scalars().first()
-        
-        if user_db and verify_password(password, user_db.hashed_password):
-            # CORRECCIÓN 1: Pasar 'id' explícitamente para que coincida con el DataLayer
-            return cl.User(
-                identifier=username, 
-                id=str(user_db.id),  # ¡IMPORTANTE! Esto evita el error 401 en el historial
-                metadata={"id": user_db.id}
-            )
-        
-        return None
+    # Buscamos al usuario por email (caché de identidades; la DB solo si no está)
+    user_db = await get_user_by_email(username)
+
+    # bcrypt se ejecuta en un pool aparte, fuera del event loop
+    if user_db and await averify_password(password, user_db["hashed_password"]):
+        # CORRECCIÓN 1: Pasar 'id' explícitamente para que coincida con el DataLayer
+        return cl.User(
+            identifier=username, 
+            id=str(user_db["id"]),  # ¡IMPORTANTE! Esto evita el error 401 en el historial
+            metadata={"id": user_db["id"]}
+        )
+    
+    return None
 
 @cl.on_chat_start
 async def start():
     # 1. Recuperar usuario y configuración
     user = cl.user_session.get("user")
     
-    # 2. Crear una nueva conversación en la DB si no estamos reanudando una
-    async with async_session() as session:
-        # Guardamos la conversación inicial
-        conv = await create_conversation(session, user_id=user.metadata["id"], title="Nueva Conversación")
-        # Guardamos el ID de la conversación en la sesión para usarlo luego
-        cl.user_session.set("conversation_id", conv.id)
+    # 2. ¿Sesión que se reconecta en otro worker? Su conversación está en el estado compartido
+    state = await load_session_state()
+    conversation_id = state.get("conversation_id")
+    saved_settings = state.get("chat_settings") or {}
+    if conversation_id:
+        cl.user_session.set("conversation_id", conversation_id)
+        await adopt_conversation(conversation_id)
+    else:
+        # Crear una nueva conversación en la DB si no estamos reanudando una
+        async with async_session() as session:
+            # Guardamos la conversación inicial
+            conv = await create_conversation(session, user_id=user.metadata["id"], title="Nueva Conversación")
+            # Guardamos el ID de la conversación en la sesión para usarlo luego
+            cl.user_session.set("conversation_id", conv.id)
+        # La conversación es nueva: su contexto empieza vacío, sin consultar la DB
+        context_cache.start(conv.id)
+        await save_session_state(conversation_id=conv.id)
 
     # 3. Configuración de Chainlit (Sidebar)
+    # El catálogo de Ollama está cacheado: no se consulta /api/tags en cada chat
+    ollama_models = await ollama_catalog.get_models()
     await cl.ChatSettings(
         [
             cl.input_widget.Select(
                 id="ModelProvider",
                 label="Proveedor de Modelo",
                 values=["ollama", "openai", "anthropic"],
-                initial_value="ollama",
+                initial_value=saved_settings.get("ModelProvider", "ollama"),
                 description="Selecciona el proveedor de IA"
             ),
+            cl.input_widget.Select(
+                id="OllamaModel",
+                label="Modelo de Ollama",
+                values=ollama_models,
+                initial_value=saved_settings.get("OllamaModel") or ("llama3" if "llama3" in ollama_models else ollama_models[0]),
+                description="Se usa con Ollama si no indicas otro nombre de modelo"
+            ),
             cl.input_widget.TextInput(
                 id="ModelName",
                 label="Nombre del Modelo (Opcional)",
-                initial_value="",
+                initial_value=saved_settings.get("ModelName", ""),
                 placeholder="llama3",
                 description="Ej: gpt-4, llama3, mistralai/mistral-7b-instruct"
             )
         ]
     ).send()
     
-    await cl.Message(
-        content="¡Sistema listo! Configura el proveedor en el menú de ajustes ⚙️."
-    ).send()
+    if not state:
+        await cl.Message(
+            content="¡Sistema listo! Configura el proveedor en el menú de ajustes ⚙️."
+        ).send()
+
+@cl.on_settings_update
+async def on_settings_update(chat_settings):
+    """Al elegir un modelo de Ollama lo precargamos para no pagar la carga en el primer mensaje."""
+    # Los ajustes se comparten: si la sesión pasa a otro worker, se conservan
+    await save_session_state(chat_settings=chat_settings)
+    if chat_settings.get("ModelProvider") == "ollama":
+        ollama_catalog.schedule_warm(chat_settings.get("ModelName") or chat_settings.get("OllamaModel"))
 
 @cl.on_chat_resume
 async def on_chat_resume(conversation):
@@ -73,6 +108,9 @@ async def on_chat_resume(conversation):
     user = cl.user_session.get("user")
     # Guardamos el ID de la conversación actual
     cl.user_session.set("conversation_id", conversation["id"])
+    await save_session_state(conversation_id=int(conversation["id"]))
+    # Precargamos el contexto reciente para que el primer mensaje no lea toda la conversación
+    await adopt_conversation(int(conversation["id"]))
 
 @cl.on_message
 async def main(message: cl.Message):
@@ -81,6 +119,14 @@ async def main(message: cl.Message):
     conversation_id = cl.user_session.get("conversation_id")
     user = cl.user_session.get("user")
 
+    if not conversation_id or not chat_settings:
+        # La sesión llegó a este worker sin pasar por on_chat_start: se recupera del estado compartido
+        state = await load_session_state()
+        conversation_id = conversation_id or state.get("conversation_id")
+        chat_settings = chat_settings or state.get("chat_settings")
+        cl.user_session.set("conversation_id", conversation_id)
+        cl.user_session.set("chat_settings", chat_settings)
+
     # Valores por defecto
     provider = "ollama"
     model_name = "llama3"
@@ -88,38 +134,116 @@ async def main(message: cl.Message):
     if chat_settings:
         provider = chat_settings.get("ModelProvider", "ollama")
         model_name = chat_settings.get("ModelName", None)
+        if provider == "ollama" and not model_name:
+            model_name = chat_settings.get("OllamaModel", None)
 
-    # 2. Guardar el mensaje del usuario en la DB
+    # 2. Guardar el mensaje del usuario en la DB (se encola; el commit va en lote)
     if conversation_id:
-        async with async_session() as session:
-            await add_message(session, conversation_id=int(conversation_id), role="user", content=message.content)
+        persistence_queue.add_message(int(conversation_id), role="user", content=message.content)
 
-            # CORRECCIÓN 2: Renombrado de conversación compatible con Chainlit nuevo
-            # Solo renombramos si es el primer mensaje o la conversación se llama "Nueva Conversación"
-            # (Lógica simplificada: renombramos siempre al principio para dar contexto)
-            # Recuperamos el hilo actual para actualizarlo
-            thread = cl.Thread(id=str(conversation_id))
-            thread.name = message.content[:30] + "..."
-            await thread.update()
+        # Renombrado de la conversación
+        # (Lógica simplificada: renombramos siempre al principio para dar contexto)
+        persistence_queue.rename_conversation(int(conversation_id), message.content[:30] + "...")
+
+        # Historial incremental, ya recortado al presupuesto de tokens
+        context_cache.append(int(conversation_id), "user", message.content)
+        history = await context_cache.get_history(int(conversation_id))
+    else:
+        history = [{"role": "user", "content": message.content}]
 
     # 3. Preparar respuesta del asistente
     msg = cl.Message(content="")
     await msg.send()
 
-    full_response = ""
+    # Los tokens se agrupan en frames para no saturar el websocket
+    coalescer = TokenCoalescer(msg.stream_token)
 
-    # 4. Streaming del LLM
-    async for token in llm_service.stream_response(
-        message=message.content, 
-        provider=provider, 
-        specific_model=model_name
-    ):
-        await msg.stream_token(token)
-        full_response += token
-    
+    async def show_queue_position(position):
+        msg.content = f"⏳ Hay mucha demanda. Estás en la cola (posición {position})..."
+        await msg.update()
+
+    # La tarea se guarda para poder cortarla si el usuario se desconecta
+    cl.user_session.set("stream_task", asyncio.current_task())
+
+    # 4. Streaming del LLM (con turno en la cola del proveedor/modelo)
+    try:
+        async with stream_scheduler.slot(
+            provider,
+            llm_service.resolve_model(provider, model_name),
+            user.identifier if user else None,
+            on_position=show_queue_position
+        ):
+            if msg.content:
+                # Salimos de la cola: se borra el aviso antes de escribir la respuesta
+                msg.content = ""
+                await msg.update()
+
+            # aclosing: al cancelar se cierra el stream HTTP y el backend deja de generar
+            async with aclosing(llm_service.stream_response(
+                history=history,
+                provider=provider, 
+                specific_model=model_name
+            )) as tokens:
+                async for token in tokens:
+                    await coalescer.feed(token)
+    except QueueFullError as e:
+        msg.content = f"⚠️ El servidor está saturado. {e}"
+        await msg.update()
+        return
+    except asyncio.CancelledError:
+        # Stop o desconexión: guardamos lo que llegó a generarse y dejamos que siga la cancelación
+        save_assistant_reply(conversation_id, coalescer.text)
+        raise
+    finally:
+        # Sin temporizador pendiente que escriba en el mensaje después de cortar el stream
+        coalescer.cancel()
+        cl.user_session.set("stream_task", None)
+
+    await coalescer.flush()
+    full_response = coalescer.text
     await msg.update()
 
     # 5. Guardar respuesta del asistente en la DB
-    if conversation_id:
-        async with async_session() as session:
-            await add_message(session, conversation_id=int(conversation_id), role="assistant", content=full_response)
\ No newline at end of file
+    save_assistant_reply(conversation_id, full_response)
+
+
+async def load_session_state() -> dict:
+    """Conversación y ajustes de esta sesión, visibles desde cualquier worker."""
+    return await shared_state.get("session", cl.context.session.id) or {}
+
+
+async def save_session_state(**changes):
+    state = await load_session_state()
+    state.update(changes)
+    await shared_state.set("session", cl.context.session.id, state)
+
+
+async def adopt_conversation(conversation_id: int):
+    """Este worker pasa a atender la conversación: los demás descartan su contexto (ya no estará al día)."""
+    context_cache.invalidate(conversation_id)
+    await context_cache.warm(conversation_id)
+
+
+def save_assistant_reply(conversation_id, content: str):
+    if conversation_id and content:
+        persistence_queue.add_message(int(conversation_id), role="assistant", content=content)
+        context_cache.append(int(conversation_id), "assistant", content)
+
+
+def cancel_stream():
+    """Corta el stream en curso de esta sesión (si lo hay)."""
+    task = cl.user_session.get("stream_task")
+    if task and not task.done():
+        task.cancel()
+
+
+@cl.on_stop
+async def on_stop():
+    # Chainlit ya cancela la tarea actual; nos aseguramos de que sea la del stream
+    cancel_stream()
+
+
+@cl.on_chat_end
+async def on_chat_end():
+    # Al cerrar la pestaña Chainlit no cancela la tarea: lo hacemos aquí
+    cancel_stream()
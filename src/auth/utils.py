@@ -1,4 +1,13 @@
+import asyncio
+import hashlib
+import hmac
+import secrets
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from passlib.context import CryptContext
+from src import metrics
+from src.cache import TTLCache
+from src.config import settings
 
 # Configuración de hashing (bcrypt)
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -10,3 +19,58 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     """Genera un hash seguro de la contraseña."""
     return pwd_context.hash(password)
+
+
+# --- API asíncrona ---
+# bcrypt tarda ~100-300 ms por llamada: ejecutarlo en el event loop congela
+# todos los streams del proceso. Estas versiones lo mandan a un pool acotado.
+_hash_pool = None
+
+# Verificaciones correctas recientes. La clave es un HMAC con un secreto
+# aleatorio del proceso, nunca la contraseña en claro.
+_verify_cache = TTLCache(max_size=settings.AUTH_VERIFY_CACHE_SIZE, ttl=settings.AUTH_VERIFY_CACHE_TTL_SECONDS)
+_verify_cache_secret = secrets.token_bytes(32)
+
+_auth_verify = metrics.auth_seconds.labels("verify")
+_auth_verify_cached = metrics.auth_seconds.labels("verify_cached")
+
+def _get_hash_pool():
+    global _hash_pool
+    if _hash_pool is None:
+        if settings.AUTH_HASH_EXECUTOR == "process":
+            _hash_pool = ProcessPoolExecutor(max_workers=settings.AUTH_HASH_WORKERS)
+        else:
+            _hash_pool = ThreadPoolExecutor(max_workers=settings.AUTH_HASH_WORKERS, thread_name_prefix="bcrypt")
+    return _hash_pool
+
+def _verify_cache_key(plain_password, hashed_password):
+    message = f"{hashed_password}\0{plain_password}".encode()
+    return hmac.new(_verify_cache_secret, message, hashlib.sha256).digest()
+
+async def averify_password(plain_password, hashed_password):
+    """Versión no bloqueante de verify_password, con caché de aciertos."""
+    start = time.perf_counter()
+    key = _verify_cache_key(plain_password, hashed_password)
+    if _verify_cache.get(key):
+        _auth_verify_cached.observe(time.perf_counter() - start)
+        return True
+
+    loop = asyncio.get_running_loop()
+    valid = await loop.run_in_executor(_get_hash_pool(), verify_password, plain_password, hashed_password)
+    if valid:
+        _verify_cache.set(key, True)
+    _auth_verify.observe(time.perf_counter() - start)
+    return valid
+
+@metrics.timed(metrics.auth_seconds, "hash")
+async def aget_password_hash(password):
+    """Versión no bloqueante de get_password_hash."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_hash_pool(), get_password_hash, password)
+
+def shutdown_hash_pool():
+    """Cierra el pool de hashing (lifespan de FastAPI)."""
+    global _hash_pool
+    if _hash_pool is not None:
+        _hash_pool.shutdown(wait=False, cancel_futures=True)
+        _hash_pool = None
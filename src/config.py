@@ -8,10 +8,110 @@ class Settings(BaseSettings):
     OPENAI_API_KEY: str = "sk-..."
     OPENROUTER_API_KEY: str = "sk-..."
     OLLAMA_BASE_URL: str = "http://localhost:11434/v1"
+    # Varios nodos Ollama (separados por comas). Vacío = solo OLLAMA_BASE_URL
+    OLLAMA_BASE_URLS: str = ""
+    OLLAMA_MODELS_REFRESH_SECONDS: float = 60.0  # Refresco del catálogo /api/tags
+    OLLAMA_PREWARM_MODELS: str = "llama3"  # Modelos a precargar al arrancar (separados por comas)
+    OLLAMA_KEEP_ALIVE: str = "30m"  # Tiempo que Ollama mantiene cargado un modelo precargado
+    OPENROUTER_BASE_URL: str = "https://openrouter.ai/api/v1"
+    OPENAI_BASE_URL: str = "https://api.openai.com/v1"
+
+    # Balanceo entre backends: sondeo de salud y expulsión tras fallos seguidos
+    BACKEND_HEALTH_INTERVAL_SECONDS: float = 10.0
+    BACKEND_HEALTH_TIMEOUT: float = 2.0
+    BACKEND_MAX_FAILURES: int = 3
+
+    # Pool de conexiones compartido por los clientes LLM
+    LLM_MAX_CONNECTIONS: int = 100
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    LLM_KEEPALIVE_EXPIRY: float = 60.0  # segundos
+    LLM_CONNECT_TIMEOUT: float = 5.0
+    LLM_READ_TIMEOUT: float = 300.0
+
+    # Admisión de streams: límite por proveedor/modelo y cola justa entre usuarios
+    SCHED_MAX_CONCURRENT_STREAMS: int = 8  # Límite por defecto de cada proveedor/modelo
+    # Excepciones: "ollama=4" limita todo el proveedor, "openai:gpt-4=2" un modelo
+    SCHED_LIMITS: str = ""
+    SCHED_MAX_QUEUE: int = 100  # Peticiones en espera por proveedor/modelo
+    SCHED_POSITION_UPDATE_SECONDS: float = 1.0
+
+    # Caché de respuestas del LLM (opcional)
+    LLM_CACHE_ENABLED: bool = False
+    LLM_CACHE_MAX_ENTRIES: int = 1000
+    LLM_CACHE_TTL_SECONDS: float = 3600.0
+    LLM_CACHE_DISK_PATH: str = ""  # p. ej. "./llm_cache.db"; vacío = solo memoria
+    LLM_CACHE_DISK_MAX_ENTRIES: int = 100000
+
+    # Streaming: se agrupan tokens y se envía un frame cada N ms o K caracteres
+    STREAM_FLUSH_INTERVAL_MS: int = 50
+    STREAM_FLUSH_MAX_CHARS: int = 256
+
+    # Persistencia diferida: un commit por intervalo para todas las conversaciones
+    PERSIST_FLUSH_INTERVAL_MS: int = 200
+    PERSIST_MAX_BATCH: int = 500
+
+    # Caché de contexto por conversación (historial enviado al LLM)
+    CONTEXT_CACHE_MAX_CONVERSATIONS: int = 1000
+    CONTEXT_TOKEN_BUDGET: int = 3000
+    CONTEXT_WARM_MESSAGES: int = 200  # Mensajes leídos de la DB al reanudar
+
+    # Carga de hilos: mensajes recientes por petición. 0 = historial completo (la UI de
+    # Chainlit no pide páginas anteriores); con un límite, el resto se pide a
+    # GET /api/threads/{id}/steps?before=<oldestStepId>
+    THREAD_STEPS_LIMIT: int = 0
+
+    # Caché de identidades (usuarios y dueño de cada conversación)
+    IDENTITY_CACHE_SIZE: int = 10000
+    IDENTITY_CACHE_TTL_SECONDS: float = 300.0
+
+    # Hashing de contraseñas fuera del event loop
+    AUTH_HASH_EXECUTOR: str = "thread"  # "thread" o "process"
+    AUTH_HASH_WORKERS: int = 4
+    AUTH_VERIFY_CACHE_SIZE: int = 10000
+    AUTH_VERIFY_CACHE_TTL_SECONDS: float = 300.0
+
+    # Adjuntos (elementos de Chainlit): ficheros por hash de contenido, fuera de la DB
+    ELEMENT_STORE_PATH: str = "./data/blobs"
+    ELEMENT_CHUNK_SIZE: int = 1048576  # 1 MiB por lectura/escritura
+
+    # Varios workers: estado de sesión compartido e invalidación de cachés
+    WEB_CONCURRENCY: int = 1  # Workers de uvicorn (el CLI de uvicorn también lee esta variable)
+    SHARED_STATE_BACKEND: str = "local"  # "local" (un worker) o "sqlite" (varios en una máquina)
+    SHARED_STATE_PATH: str = "./data/shared_state.db"
+    SHARED_STATE_POLL_MS: int = 250  # Cada cuánto mira cada worker si hay invalidaciones
+    SHARED_STATE_TTL_SECONDS: float = 86400.0  # Vida de las sesiones guardadas
+    SHARED_STATE_EVENT_TTL_SECONDS: float = 300.0
+    SHARED_STATE_MAX_KEYS: int = 100000  # Solo backend "local"
+
+    # Exportación/importación de historiales (NDJSON, opcionalmente gzip)
+    TRANSFER_BATCH_SIZE: int = 1000  # Filas por lectura (yield_per) y por INSERT agrupado
+    TRANSFER_MAX_LINE_BYTES: int = 16777216  # 16 MiB: límite de una línea al importar
+
+    # Archivo de conversaciones inactivas (mensajes comprimidos fuera de la tabla messages)
+    ARCHIVE_AFTER_DAYS: int = 0  # Días sin mensajes para archivar; 0 = desactivado
+    ARCHIVE_INTERVAL_SECONDS: float = 3600.0  # Cada cuánto se ejecuta el job dentro de la app
+    ARCHIVE_BATCH_SIZE: int = 100  # Conversaciones por transacción
+    ARCHIVE_COMPRESSION_LEVEL: int = 6  # zlib: 1 (rápido) a 9 (más compacto)
+
+    # Base de datos
+    DATABASE_URL: str = "sqlite+aiosqlite:///./chat.db"
+    DB_ECHO: bool = False  # True muestra todo el SQL en consola (solo desarrollo)
+    DB_POOL_SIZE: int = 5  # Lectores (SQLite) o pool general (otros motores)
+    DB_MAX_OVERFLOW: int = 10
+    # Perfil SQLite: "production" activa WAL y PRAGMAs al conectar; "default" los deja tal cual
+    DB_SQLITE_PROFILE: str = "production"
+    DB_SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    DB_SQLITE_MMAP_SIZE: int = 268435456  # 256 MiB
+    DB_SQLITE_CACHE_SIZE_KB: int = 65536  # 64 MiB por conexión
 
     # AÑADIDO: Clave de autenticación para Chainlit (DEBE EXISTIR AQUÍ)
     CHAINLIT_AUTH_SECRET: str 
 
+    @property
+    def ollama_base_urls(self) -> list:
+        urls = [url.strip() for url in self.OLLAMA_BASE_URLS.split(",") if url.strip()]
+        return urls or [self.OLLAMA_BASE_URL]
+
     class Config:
         env_file = ".env"
 
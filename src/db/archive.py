@@ -0,0 +1,315 @@
+"""Archivo de conversaciones inactivas.
+
+Las conversaciones sin mensajes nuevos en ARCHIVE_AFTER_DAYS días salen de la
+tabla 'messages': todos sus mensajes pasan a una sola fila de
+'archived_conversations', como JSON comprimido con zlib. La tabla caliente y
+sus índices solo crecen con lo que se usa.
+
+  - get_thread y get_older_steps leen el archivo de forma transparente.
+  - Al retomar la conversación (el contexto se carga para escribir en ella)
+    los mensajes vuelven a 'messages' con sus ids originales.
+  - La búsqueda de texto completo las sigue encontrando: su texto pasa de
+    messages_fts a archived_fts (una fila por conversación).
+
+El job corre dentro de la app cada ARCHIVE_INTERVAL_SECONDS (si
+ARCHIVE_AFTER_DAYS > 0) y también a mano:
+
+    python -m src.db.archive run [días] [--vacuum]
+    python -m src.db.archive report
+"""
+
+import asyncio
+import json
+import zlib
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, func, insert, text
+from sqlalchemy.future import select
+from src.config import settings
+from src.db.database import IS_SQLITE, async_session, engine, read_session
+from src.db.models import ArchivedConversation, Message
+from src.db.search import archived_text, index_archived
+from src.metrics import archive_bytes_total, archive_conversations_total, db_query_seconds, timed
+
+# Mismos campos que las filas de 'messages' que consume el data layer (_to_step)
+ArchivedMessage = namedtuple("ArchivedMessage", "id role content created_at")
+
+_IN_CHUNK = 500  # Ids por cláusula IN (SQLite limita las variables por consulta)
+
+
+# --- Formato del archivo ---
+def _encode(messages: list):
+    """Devuelve (datos comprimidos, tamaño sin comprimir)."""
+    raw = json.dumps(
+        [[m.id, m.role, m.content, m.created_at.isoformat() if m.created_at else None] for m in messages],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode()
+    return zlib.compress(raw, settings.ARCHIVE_COMPRESSION_LEVEL), len(raw)
+
+
+def decode(data: bytes) -> list:
+    """Mensajes archivados, en orden cronológico."""
+    return [
+        ArchivedMessage(id, role, content, datetime.fromisoformat(created_at) if created_at else None)
+        for id, role, content, created_at in json.loads(zlib.decompress(data))
+    ]
+
+
+async def load_archived(session, conversation_id: int) -> list:
+    """Mensajes archivados de una conversación ([] si no tiene). Usa la sesión del llamador."""
+    result = await session.execute(
+        select(ArchivedConversation.data).filter(ArchivedConversation.conversation_id == conversation_id)
+    )
+    data = result.scalar()
+    return decode(data) if data is not None else []
+
+
+# --- Archivar ---
+def _sort_key(message):
+    return (message.created_at or datetime.min, message.id)
+
+
+@timed(db_query_seconds, "archive.batch")
+async def _archive_batch(conversation_ids: list) -> dict:
+    report = {"conversations": 0, "messages": 0, "raw_bytes": 0, "compressed_bytes": 0}
+    async with async_session() as session:
+        # DELETE ... RETURNING: leer y borrar en la misma sentencia; no se cuela nada entre medias
+        result = await session.execute(
+            delete(Message)
+            .filter(Message.conversation_id.in_(conversation_ids))
+            .returning(Message.conversation_id, Message.id, Message.role, Message.content, Message.created_at)
+        )
+        by_conversation = {}
+        for row in result:
+            by_conversation.setdefault(row.conversation_id, []).append(
+                ArchivedMessage(row.id, row.role, row.content, row.created_at)
+            )
+
+        # Si alguna ya estaba archivada (llegó algún mensaje sin rehidratar), se fusiona con lo nuevo
+        result = await session.execute(
+            select(ArchivedConversation.conversation_id, ArchivedConversation.data)
+            .filter(ArchivedConversation.conversation_id.in_(list(by_conversation)))
+        )
+        previous = dict(result.all())
+
+        rows = []
+        texts = {}
+        for conversation_id, messages in by_conversation.items():
+            if conversation_id in previous:
+                messages += decode(previous[conversation_id])
+            messages.sort(key=_sort_key)
+            data, raw_size = _encode(messages)
+            rows.append({
+                "conversation_id": conversation_id,
+                "data": data,
+                "message_count": len(messages),
+                "raw_size": raw_size,
+                "compressed_size": len(data),
+                "last_message_at": messages[-1].created_at,
+            })
+            texts[conversation_id] = archived_text(messages)
+            report["conversations"] += 1
+            report["messages"] += len(messages)
+            report["raw_bytes"] += raw_size
+            report["compressed_bytes"] += len(data)
+
+        if previous:
+            await session.execute(
+                delete(ArchivedConversation).filter(ArchivedConversation.conversation_id.in_(list(previous)))
+            )
+        if rows:
+            await session.execute(insert(ArchivedConversation), rows)
+        # El DELETE de arriba sacó los mensajes de messages_fts: el texto pasa a archived_fts
+        # (las filas anteriores de las que se fusionan ya las quitó su trigger)
+        await index_archived(session, texts)
+        await session.commit()
+    return report
+
+
+async def archive_inactive(days: int = None) -> dict:
+    """Archiva las conversaciones sin mensajes desde hace 'days' días. Devuelve lo movido."""
+    days = days if days is not None else settings.ARCHIVE_AFTER_DAYS
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=days)
+    last_message_at = func.max(Message.created_at)
+    report = {"conversations": 0, "messages": 0, "raw_bytes": 0, "compressed_bytes": 0}
+    after_id = 0
+
+    while True:
+        # Recorrido por id (keyset) sobre ix_messages_conversation_created: cada lote sigue donde acabó el anterior
+        async with read_session() as session:
+            result = await session.execute(
+                select(Message.conversation_id)
+                .filter(Message.conversation_id > after_id)
+                .group_by(Message.conversation_id)
+                .having(last_message_at < cutoff)
+                .order_by(Message.conversation_id)
+                .limit(settings.ARCHIVE_BATCH_SIZE)
+            )
+            conversation_ids = list(result.scalars())
+        if not conversation_ids:
+            break
+        after_id = conversation_ids[-1]
+
+        try:
+            batch = await _archive_batch(conversation_ids)
+        except Exception as e:
+            print(f"Error archivando {len(conversation_ids)} conversaciones: {e}")
+            continue
+        for key, value in batch.items():
+            report[key] += value
+        archive_conversations_total.labels("archive").inc(batch["conversations"])
+        archive_bytes_total.labels("raw").inc(batch["raw_bytes"])
+        archive_bytes_total.labels("compressed").inc(batch["compressed_bytes"])
+        # Entre lotes se cede el escritor a la cola de persistencia del chat
+        await asyncio.sleep(0)
+
+    return report
+
+
+# --- Rehidratar ---
+async def rehydrate(conversation_id: int) -> bool:
+    """Devuelve los mensajes archivados a 'messages'. False si la conversación no estaba archivada."""
+    # Camino habitual (no archivada): una lectura por clave primaria, sin tocar el escritor
+    async with read_session() as session:
+        result = await session.execute(
+            select(ArchivedConversation.conversation_id)
+            .filter(ArchivedConversation.conversation_id == conversation_id)
+        )
+        if result.scalar() is None:
+            return False
+
+    async with async_session() as session:
+        # Con varios workers solo uno obtiene la fila: el resto no duplica mensajes
+        result = await session.execute(
+            delete(ArchivedConversation)
+            .filter(ArchivedConversation.conversation_id == conversation_id)
+            .returning(ArchivedConversation.data)
+        )
+        data = result.scalar()
+        if data is None:
+            return False
+        messages = decode(data)
+
+        # Se conservan los ids (Chainlit los usa como id de step) salvo que ya estén ocupados
+        ids = [m.id for m in messages]
+        taken = set()
+        for start in range(0, len(ids), _IN_CHUNK):
+            result = await session.execute(select(Message.id).filter(Message.id.in_(ids[start:start + _IN_CHUNK])))
+            taken.update(result.scalars())
+
+        rows = [
+            {"id": m.id, "conversation_id": conversation_id, "role": m.role, "content": m.content, "created_at": m.created_at}
+            for m in messages
+        ]
+        keep_ids = [row for row in rows if row["id"] not in taken]
+        new_ids = [{k: v for k, v in row.items() if k != "id"} for row in rows if row["id"] in taken]
+        if keep_ids:
+            await session.execute(insert(Message), keep_ids)
+        if new_ids:
+            await session.execute(insert(Message), new_ids)
+        await session.commit()
+
+    archive_conversations_total.labels("rehydrate").inc()
+    return True
+
+
+# --- Informe ---
+async def archive_report() -> dict:
+    """Totales del archivo y, en SQLite, cuánto ocupa la base y cuánto espacio libre tiene."""
+    async with read_session() as session:
+        result = await session.execute(
+            select(
+                func.count(ArchivedConversation.conversation_id),
+                func.coalesce(func.sum(ArchivedConversation.message_count), 0),
+                func.coalesce(func.sum(ArchivedConversation.raw_size), 0),
+                func.coalesce(func.sum(ArchivedConversation.compressed_size), 0),
+            )
+        )
+        conversations, messages, raw_bytes, compressed_bytes = result.one()
+        report = {
+            "conversations": conversations,
+            "messages": messages,
+            "raw_bytes": raw_bytes,
+            "compressed_bytes": compressed_bytes,
+            "saved_bytes": raw_bytes - compressed_bytes,
+        }
+        if IS_SQLITE:
+            # Las páginas liberadas se reutilizan; VACUUM las devuelve al sistema
+            page_size = (await session.execute(text("PRAGMA page_size"))).scalar()
+            page_count = (await session.execute(text("PRAGMA page_count"))).scalar()
+            freelist = (await session.execute(text("PRAGMA freelist_count"))).scalar()
+            report["db_bytes"] = page_size * page_count
+            report["free_bytes"] = page_size * freelist
+    return report
+
+
+async def vacuum():
+    """Compacta el fichero SQLite (bloquea la base mientras dura: solo desde la CLI)."""
+    async with engine.connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("VACUUM"))
+
+
+# --- Job periódico ---
+class ArchiveJob:
+    def __init__(self):
+        self.last_run = None  # Informe de la última ejecución
+        self._task = None
+
+    def start(self):
+        if settings.ARCHIVE_AFTER_DAYS > 0 and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(settings.ARCHIVE_INTERVAL_SECONDS)
+            try:
+                report = await archive_inactive()
+                self.last_run = {"finished_at": datetime.now(timezone.utc).isoformat(), **report}
+                if report["conversations"]:
+                    print(
+                        f"Archivadas {report['conversations']} conversaciones ({report['messages']} mensajes): "
+                        f"{report['raw_bytes']} -> {report['compressed_bytes']} bytes"
+                    )
+            except Exception as e:
+                print(f"Error en el job de archivo: {e}")
+
+    def stats(self) -> dict:
+        return {"enabled": self._task is not None, "last_run": self.last_run}
+
+
+archive_job = ArchiveJob()
+
+
+# --- CLI ---
+async def _main(args: list):
+    from src.db.database import dispose_engines
+    try:
+        if args[0] == "run":
+            days = next((int(arg) for arg in args[1:] if arg.isdigit()), None)
+            if days is None and settings.ARCHIVE_AFTER_DAYS <= 0:
+                raise SystemExit("Indica los días (o define ARCHIVE_AFTER_DAYS)")
+            before = await archive_report()
+            print("Archivado:", json.dumps(await archive_inactive(days)))
+            if "--vacuum" in args and IS_SQLITE:
+                await vacuum()
+            after = await archive_report()
+            if IS_SQLITE:
+                print(f"Base de datos: {before['db_bytes']} -> {after['db_bytes']} bytes ({after['free_bytes']} libres)")
+        print("Total archivado:", json.dumps(await archive_report()))
+    finally:
+        await dispose_engines()
+
+
+if __name__ == "__main__":
+    import sys
+    if not sys.argv[1:] or sys.argv[1] not in ("run", "report"):
+        raise SystemExit("Uso: python -m src.db.archive run [días] [--vacuum] | report")
+    asyncio.run(_main(sys.argv[1:]))
@@ -0,0 +1,83 @@
+"""Almacén local de adjuntos direccionado por contenido.
+
+Cada fichero se guarda una sola vez con su SHA-256 como nombre
+(<raíz>/ab/cd/abcd...), así que subir dos veces lo mismo no ocupa el doble.
+La copia se hace por bloques mientras se calcula el hash, en un hilo aparte:
+ni se carga el fichero entero en memoria ni se bloquea el event loop.
+"""
+
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+from src.config import settings
+
+
+class BlobStore:
+    def __init__(self, root: str = None, chunk_size: int = None):
+        self.root = os.path.abspath(root or settings.ELEMENT_STORE_PATH)
+        self.chunk_size = chunk_size or settings.ELEMENT_CHUNK_SIZE
+        # Serializa "sumar referencia" frente a "borrar el último": evita borrar
+        # un fichero que otra subida acaba de encontrar deduplicado
+        self.lock = asyncio.Lock()
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.path_for(digest))
+
+    async def put_file(self, source_path: str):
+        """Copia un fichero al almacén. Devuelve (hash, tamaño)."""
+        return await asyncio.to_thread(self._ingest, lambda: open(source_path, "rb"))
+
+    async def put_bytes(self, content):
+        """Para elementos que ya traen el contenido en memoria (bytes o str)."""
+        data = content.encode() if isinstance(content, str) else content
+        return await asyncio.to_thread(self._ingest_bytes, data)
+
+    async def delete(self, digest: str):
+        await asyncio.to_thread(self._remove, digest)
+
+    # --- Parte síncrona (se ejecuta en un hilo) ---
+    def _ingest(self, open_source):
+        tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        hasher = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with open_source() as source, os.fdopen(fd, "wb") as target:
+                while chunk := source.read(self.chunk_size):
+                    hasher.update(chunk)
+                    target.write(chunk)
+                    size += len(chunk)
+            digest = hasher.hexdigest()
+            final_path = self.path_for(digest)
+            if os.path.exists(final_path):
+                # Ya estaba: deduplicado
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(tmp_path, final_path)
+            return digest, size
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _ingest_bytes(self, data: bytes):
+        digest = hashlib.sha256(data).hexdigest()
+        if os.path.exists(self.path_for(digest)):
+            return digest, len(data)
+        return self._ingest(lambda: io.BytesIO(data))
+
+    def _remove(self, digest: str):
+        try:
+            os.remove(self.path_for(digest))
+        except FileNotFoundError:
+            pass
+
+
+blob_store = BlobStore()
@@ -1,74 +1,212 @@
+import json
+from collections import Counter
 import chainlit as cl
 import chainlit.data as cl_data
+from chainlit.context import ChainlitContextException
 from chainlit.types import ThreadDict, ThreadFilter, Pagination, Feedback, PaginatedResponse, PageInfo
 from sqlalchemy.future import select
-from sqlalchemy import delete
-from src.db.database import async_session
-from src.db.models import User, Conversation, Message
+from sqlalchemy import delete, update, and_, or_
+from src.config import settings
+from src.db.database import async_session, read_session
+from src.db.models import Conversation, Message, Element, Blob, ArchivedConversation
+from src.db.archive import ArchivedMessage, load_archived
+from src.db.blob_store import blob_store
 from src.db.crud import create_conversation, add_message
+from src.db.write_queue import persistence_queue
+from src.db.search import search_conversations
+from src.db.identity_cache import get_user_by_email, remember_thread, invalidate_thread, thread_cache
+from src.services.context_cache import context_cache
+from src.metrics import db_query_seconds, timed
 
 class CustomDataLayer(cl_data.BaseDataLayer):
+    OLDER_STEPS_PAGE = 100  # Página de get_older_steps cuando THREAD_STEPS_LIMIT es 0
+    ARCHIVED_CURSOR_PREFIX = "a"  # oldestStepId de un mensaje archivado ("a<id>")
+
+    @timed(db_query_seconds, "data_layer.get_user")
     async def get_user(self, identifier: str):
         """
         Recupera el usuario de la DB cuando se recarga la sesión.
         CRÍTICO: Debe devolver metadata con el ID para que app.py no falle.
         """
-        async with async_session() as session:
-            result = await session.execute(select(User).filter(User.email == identifier))
-            user_db = result.scalars().first()
-            
-            if user_db:
-                return cl.PersistedUser(
-                    id=str(user_db.id),
-                    identifier=user_db.email,
-                    createdAt=user_db.created_at.isoformat() if user_db.created_at else None,
-                    metadata={"id": user_db.id} # ¡ESTO ES LO QUE FALTABA PARA EL ERROR KEYERROR 'ID'!
-                )
-            return None
+        user = await get_user_by_email(identifier)
+        if user:
+            return cl.PersistedUser(
+                id=str(user["id"]),
+                identifier=user["email"],
+                createdAt=user["created_at"].isoformat() if user["created_at"] else None,
+                metadata={"id": user["id"]} # ¡ESTO ES LO QUE FALTABA PARA EL ERROR KEYERROR 'ID'!
+            )
+        return None
 
     async def create_user(self, user: cl.User): 
         pass
 
+    @timed(db_query_seconds, "data_layer.get_thread")
     async def get_thread(self, thread_id: str):
-        """Recupera una conversación completa."""
-        async with async_session() as session:
-            try:
-                t_id = int(thread_id)
-            except ValueError:
-                return None
-
-            result = await session.execute(select(Conversation).filter(Conversation.id == t_id))
-            conversation = result.scalars().first()
-            if not conversation:
-                return None
-
-            msgs_result = await session.execute(
-                select(Message)
-                .filter(Message.conversation_id == t_id)
-                .order_by(Message.created_at.asc())
-            )
-            db_messages = msgs_result.scalars().all()
-
-            steps = []
-            for msg in db_messages:
-                steps.append({
-                    "id": str(msg.id),
-                    "type": "user_message" if msg.role == "user" else "assistant_message",
-                    "content": msg.content,
-                    "createdAt": msg.created_at.isoformat() if msg.created_at else None,
-                })
-
-            return {
-                "id": str(conversation.id),
-                "createdAt": conversation.created_at.isoformat() if conversation.created_at else None,
-                "name": conversation.title,
-                "userId": str(conversation.user_id),
-                "steps": steps,
-                "metadata": {} 
+        """
+        Recupera una conversación con sus mensajes (los últimos THREAD_STEPS_LIMIT
+        si hay límite). Metadatos y mensajes salen de una sola consulta; los mensajes
+        más antiguos se piden aparte con get_older_steps (/api/threads/{id}/steps). Si la conversación está
+        archivada, sus mensajes se leen descomprimidos del archivo.
+        """
+        try:
+            t_id = int(thread_id)
+        except ValueError:
+            return None
+
+        # Read-your-writes: lo que siga en la cola de escritura se vuelca antes de leer
+        await persistence_queue.wait_for(t_id)
+
+        limit = settings.THREAD_STEPS_LIMIT or None  # 0 = sin límite
+        conversation = thread_cache.get(t_id)
+
+        async with read_session() as session:
+            if conversation:
+                # La fila está en la caché (p. ej. de la comprobación de autor): solo faltan los mensajes
+                result = await session.execute(
+                    select(Message.id, Message.role, Message.content, Message.created_at)
+                    .filter(Message.conversation_id == t_id)
+                    .order_by(Message.created_at.desc(), Message.id.desc())
+                    .limit(limit + 1 if limit else None)
+                )
+                rows = result.all()
+            else:
+                result = await session.execute(
+                    select(
+                        Conversation.id.label("conversation_id"),
+                        Conversation.title,
+                        Conversation.user_id,
+                        Conversation.created_at.label("conversation_created_at"),
+                        Message.id,
+                        Message.role,
+                        Message.content,
+                        Message.created_at,
+                    )
+                    .outerjoin(Message, Message.conversation_id == Conversation.id)
+                    .filter(Conversation.id == t_id)
+                    .order_by(Message.created_at.desc(), Message.id.desc())
+                    .limit(limit + 1 if limit else None)
+                )
+                rows = result.all()
+                if not rows:
+                    return None
+                first = rows[0]
+                conversation = remember_thread(
+                    t_id, first.user_id, first.title, first.conversation_created_at
+                )
+                # Conversación sin mensajes: el outer join devuelve una fila vacía
+                rows = [row for row in rows if row.id is not None]
+
+            # Si faltan mensajes para llenar la página, puede que el resto esté archivado (más antiguo)
+            if limit is None or len(rows) <= limit:
+                rows += reversed(await load_archived(session, t_id))
+
+            # Adjuntos: solo metadatos; el contenido se descarga aparte (/api/elements)
+            result = await session.execute(select(Element).filter(Element.conversation_id == t_id))
+            elements = [self._to_element(element) for element in result.scalars().all()]
+
+        has_older_steps = limit is not None and len(rows) > limit
+        rows = rows[:limit]
+        steps = [self._to_step(row) for row in reversed(rows)]
+
+        return {
+            "id": str(t_id),
+            "createdAt": conversation["created_at"].isoformat() if conversation["created_at"] else None,
+            "name": conversation["title"],
+            "userId": str(conversation["user_id"]),
+            "steps": steps,
+            "elements": elements,
+            "metadata": {
+                "hasOlderSteps": has_older_steps,
+                "oldestStepId": self.step_cursor(steps[0]) if steps else None,
             }
+        }
+
+    @timed(db_query_seconds, "data_layer.get_older_steps")
+    async def get_older_steps(self, thread_id: str, before_step_id: str, limit: int = None):
+        """
+        Página de mensajes anteriores a 'before_step_id' (un oldestStepId), en orden cronológico.
+        Los ids de los archivados pueden coincidir con los de mensajes vivos (messages no
+        usa AUTOINCREMENT y archivar libera los más altos): su cursor lleva el prefijo
+        ARCHIVED_CURSOR_PREFIX, y un id sin prefijo solo se busca en el archivo si no es
+        un mensaje vivo de la conversación.
+        """
+        in_archive = before_step_id.startswith(self.ARCHIVED_CURSOR_PREFIX)
+        try:
+            t_id = int(thread_id)
+            before_id = int(before_step_id[len(self.ARCHIVED_CURSOR_PREFIX):] if in_archive else before_step_id)
+        except ValueError:
+            return []
+
+        limit = limit or settings.THREAD_STEPS_LIMIT or self.OLDER_STEPS_PAGE
+        before_created_at = (
+            select(Message.created_at)
+            .filter(Message.id == before_id, Message.conversation_id == t_id)
+            .scalar_subquery()
+        )
+        async with read_session() as session:
+            rows = []
+            if not in_archive:
+                result = await session.execute(
+                    select(Message.id, Message.role, Message.content, Message.created_at)
+                    .filter(
+                        Message.conversation_id == t_id,
+                        or_(
+                            Message.created_at < before_created_at,
+                            and_(Message.created_at == before_created_at, Message.id < before_id),
+                        ),
+                    )
+                    .order_by(Message.created_at.desc(), Message.id.desc())
+                    .limit(limit)
+                )
+                rows = result.all()
+
+            if len(rows) < limit:
+                # Los archivados son anteriores a los de 'messages': si 'before' es un mensaje
+                # vivo, el archivo entra desde el final
+                archived = await load_archived(session, t_id)
+                position = len(archived)
+                if archived and not rows:
+                    if not in_archive:
+                        result = await session.execute(
+                            select(Message.id).filter(Message.id == before_id, Message.conversation_id == t_id)
+                        )
+                        in_archive = result.scalar() is None
+                    if in_archive:
+                        position = next((i for i, m in enumerate(archived) if m.id == before_id), len(archived))
+                rows += list(reversed(archived[:position]))[:limit - len(rows)]
+        return [self._to_step(row) for row in reversed(rows)]
 
+    @classmethod
+    def step_cursor(cls, step: dict) -> str:
+        """oldestStepId de un step: los archivados llevan prefijo para no confundirse con un id vivo."""
+        if step.get("metadata", {}).get("archived"):
+            return f"{cls.ARCHIVED_CURSOR_PREFIX}{step['id']}"
+        return step["id"]
+
+    @staticmethod
+    def _to_step(row):
+        step = {
+            "id": str(row.id),
+            "type": "user_message" if row.role == "user" else "assistant_message",
+            "content": row.content,
+            "createdAt": row.created_at.isoformat() if row.created_at else None,
+        }
+        if isinstance(row, ArchivedMessage):
+            step["metadata"] = {"archived": True}
+        return step
+
+    @timed(db_query_seconds, "data_layer.list_threads")
     async def list_threads(self, pagination: Pagination, filter: ThreadFilter):
-        """Lista las conversaciones en la barra lateral."""
+        """
+        Lista las conversaciones en la barra lateral.
+        Paginación por cursor (keyset): el cursor es el id de la última conversación
+        de la página anterior, así cada página es un rango del índice
+        (user_id, created_at, id) en lugar de un OFFSET que crece.
+        La fecha del cursor se lee de la base en la misma consulta: se compara con el
+        valor guardado tal cual (server_default no guarda microsegundos). Si esa
+        conversación ya no existe (p. ej. se acaba de borrar), se sigue por id.
+        """
         
         # Objeto PageInfo completo para evitar ValidationError
         empty_page_info = PageInfo(
@@ -81,33 +219,95 @@ class CustomDataLayer(cl_data.BaseDataLayer):
         if not filter.userId:
             return PaginatedResponse(data=[], pageInfo=empty_page_info)
 
-        async with async_session() as session:
+        user_id = int(filter.userId)
+        page_size = pagination.first
+
+        if filter.search:
+            return await self._search_threads(user_id, filter.search, pagination, empty_page_info)
+
+        async with read_session() as session:
             stmt = (
-                select(Conversation)
-                .filter(Conversation.user_id == int(filter.userId))
-                .order_by(Conversation.created_at.desc())
-                .limit(pagination.first)
+                select(Conversation.id, Conversation.title, Conversation.user_id, Conversation.created_at)
+                .filter(Conversation.user_id == user_id)
+                .order_by(Conversation.created_at.desc(), Conversation.id.desc())
+                .limit(page_size + 1)  # Una fila extra indica si hay página siguiente
             )
-            
+
+            if pagination.cursor:
+                try:
+                    cursor_id = int(pagination.cursor)
+                except ValueError:
+                    return PaginatedResponse(data=[], pageInfo=empty_page_info)
+                # La fecha del cursor se resuelve dentro de la misma consulta
+                cursor_created_at = (
+                    select(Conversation.created_at)
+                    .filter(Conversation.id == cursor_id, Conversation.user_id == user_id)
+                    .scalar_subquery()
+                )
+                stmt = stmt.filter(
+                    or_(
+                        Conversation.created_at < cursor_created_at,
+                        and_(Conversation.created_at == cursor_created_at, Conversation.id < cursor_id),
+                        and_(cursor_created_at.is_(None), Conversation.id < cursor_id),
+                    )
+                )
+
             result = await session.execute(stmt)
-            conversations = result.scalars().all()
-
-            threads = []
-            for conv in conversations:
-                threads.append({
-                    "id": str(conv.id),
-                    "createdAt": conv.created_at.isoformat() if conv.created_at else None,
-                    "name": conv.title,
-                    "userId": str(conv.user_id),
-                    "steps": [],
-                    "metadata": {}
-                })
-
-            return PaginatedResponse(
-                data=threads, 
-                pageInfo=empty_page_info # ¡SOLUCIÓN AL VALIDATION ERROR!
-            )
+            rows = result.all()
+
+        has_next_page = len(rows) > page_size
+        rows = rows[:page_size]
+
+        threads = []
+        for row in rows:
+            threads.append({
+                "id": str(row.id),
+                "createdAt": row.created_at.isoformat() if row.created_at else None,
+                "name": row.title,
+                "userId": str(row.user_id),
+                "steps": [],
+                "metadata": {}
+            })
+
+        page_info = PageInfo(
+            hasNextPage=has_next_page,
+            hasPreviousPage=bool(pagination.cursor),
+            startCursor=threads[0]["id"] if threads else None,
+            endCursor=threads[-1]["id"] if threads else None
+        )
+        return PaginatedResponse(data=threads, pageInfo=page_info)
 
+    async def _search_threads(self, user_id: int, search: str, pagination: Pagination, empty_page_info):
+        """
+        Búsqueda de la barra lateral: índice de texto completo, ordenado por relevancia.
+        Aquí el cursor es la posición en la lista de resultados.
+        """
+        try:
+            offset = int(pagination.cursor) if pagination.cursor else 0
+        except ValueError:
+            return PaginatedResponse(data=[], pageInfo=empty_page_info)
+
+        results, has_next_page = await search_conversations(user_id, search, pagination.first, offset)
+        threads = []
+        for row in results:
+            threads.append({
+                "id": str(row["conversation_id"]),
+                "createdAt": row["created_at"].isoformat() if row["created_at"] else None,
+                "name": row["title"],
+                "userId": str(user_id),
+                "steps": [],
+                "metadata": {"snippet": row["snippet"]} if row["snippet"] else {}
+            })
+
+        page_info = PageInfo(
+            hasNextPage=has_next_page,
+            hasPreviousPage=offset > 0,
+            startCursor=str(offset) if threads else None,
+            endCursor=str(offset + len(threads)) if threads else None
+        )
+        return PaginatedResponse(data=threads, pageInfo=page_info)
+
+    @timed(db_query_seconds, "data_layer.update_thread")
     async def update_thread(self, thread_id: str, name: str = None, user_id: str = None, metadata: dict = None, tags: list = None):
         if name:
              try:
@@ -115,43 +315,201 @@ class CustomDataLayer(cl_data.BaseDataLayer):
              except ValueError:
                  return
 
+             # Un renombrado encolado no debe pisar el que llega desde la UI
+             await persistence_queue.wait_for(t_id)
+
              async with async_session() as session:
                 result = await session.execute(select(Conversation).filter(Conversation.id == t_id))
                 conversation = result.scalars().first()
                 if conversation:
                     conversation.title = name
                     await session.commit()
+             invalidate_thread(t_id)
 
+    @timed(db_query_seconds, "data_layer.delete_thread")
     async def delete_thread(self, thread_id: str):
         try:
              t_id = int(thread_id)
         except ValueError:
              return
 
-        async with async_session() as session:
-            await session.execute(delete(Conversation).filter(Conversation.id == t_id))
-            await session.commit()
+        # Evita que mensajes encolados se inserten después del borrado
+        await persistence_queue.wait_for(t_id)
+
+        async with blob_store.lock:
+            async with async_session() as session:
+                result = await session.execute(
+                    select(Element.blob_hash).filter(Element.conversation_id == t_id)
+                )
+                orphans = await self._release_blobs(session, [row.blob_hash for row in result])
+                await session.execute(delete(Element).filter(Element.conversation_id == t_id))
+                await session.execute(delete(ArchivedConversation).filter(ArchivedConversation.conversation_id == t_id))
+                await session.execute(delete(Conversation).filter(Conversation.id == t_id))
+                await session.commit()
+            for digest in orphans:
+                await blob_store.delete(digest)
+        context_cache.invalidate(t_id)
+        invalidate_thread(t_id)
     
+    @timed(db_query_seconds, "data_layer.get_thread_author")
     async def get_thread_author(self, thread_id: str):
          try:
              t_id = int(thread_id)
          except ValueError:
              return ""
 
-         async with async_session() as session:
-            result = await session.execute(select(Conversation).filter(Conversation.id == t_id))
-            conversation = result.scalars().first()
-            if conversation:
-                 return str(conversation.user_id)
+         conversation = thread_cache.get(t_id)
+         if conversation:
+             return str(conversation["user_id"])
+
+         async with read_session() as session:
+            result = await session.execute(
+                select(Conversation.user_id, Conversation.title, Conversation.created_at)
+                .filter(Conversation.id == t_id)
+            )
+            row = result.first()
+            if row:
+                 remember_thread(t_id, row.user_id, row.title, row.created_at)
+                 return str(row.user_id)
             return ""
 
+    # --- ADJUNTOS (ELEMENTOS) ---
+    # Contenido en blob_store (por hash, deduplicado); en la DB solo metadatos y referencias.
+
+    @timed(db_query_seconds, "data_layer.create_element")
+    async def create_element(self, element):
+        # 1. Conversación a la que pertenece
+        conversation_id = self._conversation_for(element.thread_id)
+        if conversation_id is None:
+            return
+
+        # 2. Contenido al almacén: por bloques y en un hilo, sin cargarlo en memoria
+        if element.path:
+            store_content = lambda: blob_store.put_file(element.path)
+        elif element.content is not None:
+            store_content = lambda: blob_store.put_bytes(element.content)
+        else:
+            store_content = None  # Elemento externo (solo URL)
+        digest = size = None
+        if store_content:
+            digest, size = await store_content()
+
+        # 3. Metadatos y referencia al blob en una sola transacción
+        async with blob_store.lock:
+            if digest and not blob_store.exists(digest):
+                # Su último dueño lo borró mientras copiábamos: se vuelve a guardar
+                digest, size = await store_content()
+            async with async_session() as session:
+                previous = await session.get(Element, element.id)
+                orphans = await self._release_blobs(session, [previous.blob_hash]) if previous else []
+                if digest:
+                    await self._add_blob_ref(session, digest, size)
+                    if digest in orphans:
+                        orphans.remove(digest)
+                await session.merge(Element(
+                    id=element.id,
+                    conversation_id=conversation_id,
+                    for_id=element.for_id,
+                    blob_hash=digest,
+                    url=None if digest else element.url,
+                    type=element.type,
+                    name=element.name,
+                    mime=element.mime or "application/octet-stream",
+                    display=element.display,
+                    size=getattr(element, "size", None),
+                    language=getattr(element, "language", None),
+                    page=getattr(element, "page", None),
+                    props=json.dumps(element.props) if getattr(element, "props", None) else None,
+                ))
+                await session.commit()
+            for orphan in orphans:
+                await blob_store.delete(orphan)
+
+    @timed(db_query_seconds, "data_layer.get_element")
+    async def get_element(self, thread_id: str, element_id: str):
+        async with read_session() as session:
+            element = await session.get(Element, element_id)
+        if element is None or str(element.conversation_id) != str(thread_id):
+            return None
+        return self._to_element(element)
+
+    @timed(db_query_seconds, "data_layer.delete_element")
+    async def delete_element(self, element_id: str, thread_id: str = None):
+        async with blob_store.lock:
+            async with async_session() as session:
+                element = await session.get(Element, element_id)
+                if element is None:
+                    return
+                orphans = await self._release_blobs(session, [element.blob_hash])
+                await session.delete(element)
+                await session.commit()
+            for digest in orphans:
+                await blob_store.delete(digest)
+
+    @staticmethod
+    def _conversation_for(thread_id: str):
+        """Id de conversación del elemento: el hilo reanudado o la conversación de la sesión."""
+        try:
+            return int(thread_id)
+        except (TypeError, ValueError):
+            pass
+        try:
+            conversation_id = cl.user_session.get("conversation_id")
+        except ChainlitContextException:
+            return None
+        return int(conversation_id) if conversation_id else None
+
+    @staticmethod
+    async def _add_blob_ref(session, digest: str, size: int):
+        result = await session.execute(
+            update(Blob).filter(Blob.hash == digest).values(ref_count=Blob.ref_count + 1)
+        )
+        if result.rowcount == 0:
+            session.add(Blob(hash=digest, size=size, ref_count=1))
+            await session.flush()
+
+    @staticmethod
+    async def _release_blobs(session, digests: list) -> list:
+        """Resta referencias; devuelve los blobs que se quedan sin uso (borrar tras el commit)."""
+        counts = Counter(d for d in digests if d)
+        for digest, count in counts.items():
+            await session.execute(
+                update(Blob).filter(Blob.hash == digest).values(ref_count=Blob.ref_count - count)
+            )
+        if not counts:
+            return []
+        result = await session.execute(
+            select(Blob.hash).filter(Blob.hash.in_(list(counts)), Blob.ref_count <= 0)
+        )
+        orphans = [row.hash for row in result]
+        if orphans:
+            await session.execute(delete(Blob).filter(Blob.hash.in_(orphans)))
+        return orphans
+
+    @staticmethod
+    def _to_element(element: Element) -> dict:
+        return {
+            "id": element.id,
+            "threadId": str(element.conversation_id),
+            "type": element.type,
+            "name": element.name,
+            "mime": element.mime,
+            "display": element.display,
+            "size": element.size,
+            "language": element.language,
+            "page": element.page,
+            "props": json.loads(element.props) if element.props else {},
+            "forId": element.for_id,
+            # Los blobs se sirven por nuestra ruta (con Range); los externos, por su URL
+            "url": f"/api/elements/{element.id}" if element.blob_hash else element.url,
+            "objectKey": element.blob_hash,
+            "chainlitKey": None,
+        }
+
     # --- MÉTODOS OBLIGATORIOS (STUBS) ---
     async def create_step(self, step_dict: dict): pass 
     async def update_step(self, step_dict: dict): pass
     async def delete_step(self, step_id: str): pass
-    async def get_element(self, thread_id: str, element_id: str): pass
-    async def create_element(self, element_dict: dict): pass
-    async def delete_element(self, element_id: str): pass
     async def upsert_feedback(self, feedback: Feedback): pass
     async def delete_feedback(self, feedback_id: str): pass
     async def build_debug_url(self): pass
@@ -1,7 +1,9 @@
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from src.db.models import Conversation, Message
+from src.metrics import db_query_seconds, timed
 
+@timed(db_query_seconds, "crud.create_conversation")
 async def create_conversation(db: AsyncSession, user_id: int, title: str = "Nueva Conversación"):
     """Crea una nueva entrada de conversación."""
     db_conversation = Conversation(user_id=user_id, title=title)
@@ -10,6 +12,7 @@ async def create_conversation(db: AsyncSession, user_id: int, title: str = "Nuev
     await db.refresh(db_conversation)
     return db_conversation
 
+@timed(db_query_seconds, "crud.add_message")
 async def add_message(db: AsyncSession, conversation_id: int, role: str, content: str):
     """Guarda un mensaje en una conversación específica."""
     db_message = Message(conversation_id=conversation_id, role=role, content=content)
@@ -18,6 +21,7 @@ async def add_message(db: AsyncSession, conversation_id: int, role: str, content
     await db.refresh(db_message)
     return db_message
 
+@timed(db_query_seconds, "crud.get_conversation_history")
 async def get_conversation_history(db: AsyncSession, conversation_id: int):
     """Recupera todos los mensajes de una conversación."""
     result = await db.execute(
@@ -25,4 +29,15 @@ async def get_conversation_history(db: AsyncSession, conversation_id: int):
         .filter(Message.conversation_id == conversation_id)
         .order_by(Message.created_at.asc())
     )
-    return result.scalars().all()
\ No newline at end of file
+    return result.scalars().all()
+
+@timed(db_query_seconds, "crud.get_recent_messages")
+async def get_recent_messages(db: AsyncSession, conversation_id: int, limit: int):
+    """Recupera los últimos 'limit' mensajes de una conversación, en orden cronológico."""
+    result = await db.execute(
+        select(Message)
+        .filter(Message.conversation_id == conversation_id)
+        .order_by(Message.created_at.desc(), Message.id.desc())
+        .limit(limit)
+    )
+    return list(reversed(result.scalars().all()))
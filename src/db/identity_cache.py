@@ -0,0 +1,63 @@
+"""Caché de identidades: usuarios y dueño de cada conversación.
+
+Chainlit pide el usuario y el autor del hilo en casi cada petición. Estas
+cachés (LRU con TTL) evitan una consulta por llamada; las escrituras que
+cambian esos datos las invalidan explícitamente, en todos los workers.
+"""
+
+from sqlalchemy.future import select
+from src.cache import TTLCache
+from src.config import settings
+from src.db.database import read_session
+from src.db.models import User
+from src.services.shared_state import shared_state
+
+# email -> {"id", "email", "hashed_password", "created_at"}
+user_cache = TTLCache(max_size=settings.IDENTITY_CACHE_SIZE, ttl=settings.IDENTITY_CACHE_TTL_SECONDS)
+
+# id de conversación -> {"user_id", "title", "created_at"}
+thread_cache = TTLCache(max_size=settings.IDENTITY_CACHE_SIZE, ttl=settings.IDENTITY_CACHE_TTL_SECONDS)
+
+
+async def get_user_by_email(email: str):
+    """Devuelve una copia del usuario (dict) o None, consultando la DB solo si no está en caché."""
+    user = user_cache.get(email)
+    if user is not None:
+        return dict(user)
+
+    async with read_session() as session:
+        result = await session.execute(select(User).filter(User.email == email))
+        user_db = result.scalars().first()
+    if not user_db:
+        return None
+
+    user = {
+        "id": user_db.id,
+        "email": user_db.email,
+        "hashed_password": user_db.hashed_password,
+        "created_at": user_db.created_at,
+    }
+    user_cache.set(email, user)
+    return dict(user)
+
+
+def remember_thread(t_id: int, user_id: int, title: str, created_at) -> dict:
+    row = {"user_id": user_id, "title": title, "created_at": created_at}
+    thread_cache.set(t_id, row)
+    return row
+
+
+def invalidate_user(email: str):
+    shared_state.invalidate("user", email)
+
+
+def invalidate_thread(t_id: int):
+    shared_state.invalidate("thread", t_id)
+
+
+shared_state.register_invalidator("user", user_cache.pop)
+shared_state.register_invalidator("thread", thread_cache.pop)
+
+
+def stats() -> dict:
+    return {"users": user_cache.stats(), "threads": thread_cache.stats()}
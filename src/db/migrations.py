@@ -0,0 +1,82 @@
+"""Versión del esquema y migraciones incrementales.
+
+En cada arranque se lee 'schema_version'. Si la base de datos ya está en la
+última versión no se ejecuta ningún DDL (ni create_all, que inspecciona
+todas las tablas). Si no, se aplican en orden las migraciones pendientes.
+
+Para cambiar el esquema se añade una migración al final de MIGRATIONS;
+nunca se edita una que ya se haya publicado.
+"""
+
+from sqlalchemy import inspect, text
+from src.db.database import Base
+from src.db.models import ArchivedConversation, create_missing_indexes
+from src.db.search import create_archived_search_index, create_search_index
+
+
+def _baseline(sync_conn):
+    # Todas las tablas del modelo (idempotente: en bases antiguas solo crea lo que falte)
+    Base.metadata.create_all(sync_conn)
+
+
+def _archive_table(sync_conn):
+    ArchivedConversation.__table__.create(sync_conn, checkfirst=True)
+
+
+# (versión, descripción, función que recibe la conexión síncrona)
+MIGRATIONS = [
+    (1, "tablas base (usuarios, conversaciones, mensajes, adjuntos)", _baseline),
+    (2, "índices compuestos de conversaciones y mensajes", create_missing_indexes),
+    (3, "índice de búsqueda FTS5", create_search_index),
+    (4, "conversaciones archivadas (mensajes comprimidos)", _archive_table),
+    (5, "búsqueda en conversaciones archivadas", create_archived_search_index),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _read_version(sync_conn):
+    row = sync_conn.execute(text("SELECT version FROM schema_version WHERE id = 1")).first()
+    return row.version if row else 0
+
+
+def current_version(sync_conn) -> int:
+    if not inspect(sync_conn).has_table("schema_version"):
+        return 0
+    return _read_version(sync_conn)
+
+
+def run_migrations(sync_conn) -> dict:
+    """
+    Lleva el esquema a LATEST_VERSION. Devuelve {"from", "to", "applied"}.
+    Con varios workers arrancando a la vez, solo uno aplica las migraciones:
+    el resto espera al bloqueo y encuentra la versión ya al día.
+    """
+    version = current_version(sync_conn)
+    if version >= LATEST_VERSION:
+        # Camino rápido: una consulta y nada de DDL
+        return {"from": version, "to": version, "applied": []}
+
+    sync_conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "id INTEGER PRIMARY KEY, version INTEGER NOT NULL, updated_at TIMESTAMP)"
+    ))
+    # La escritura toma el bloqueo de la transacción; después se relee la versión
+    if sync_conn.dialect.name == "sqlite":
+        sync_conn.execute(text("INSERT OR IGNORE INTO schema_version (id, version) VALUES (1, 0)"))
+    else:
+        sync_conn.execute(text("INSERT INTO schema_version (id, version) VALUES (1, 0) ON CONFLICT DO NOTHING"))
+    sync_conn.execute(text("UPDATE schema_version SET version = version WHERE id = 1"))
+    version = _read_version(sync_conn)
+
+    applied = []
+    for number, description, migrate in MIGRATIONS:
+        if number > version:
+            migrate(sync_conn)
+            applied.append(f"v{number}: {description}")
+
+    sync_conn.execute(
+        text("UPDATE schema_version SET version = :version, updated_at = CURRENT_TIMESTAMP WHERE id = 1"),
+        {"version": LATEST_VERSION},
+    )
+    return {"from": version, "to": LATEST_VERSION, "applied": applied}
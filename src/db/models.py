@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, Text, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from src.db.database import Base
@@ -25,6 +25,11 @@ class Conversation(Base):
     owner = relationship("User", back_populates="conversations")
     messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
 
+    # Índice compuesto para la barra lateral: filtro por usuario + orden por fecha/id
+    __table_args__ = (
+        Index("ix_conversations_user_created", "user_id", "created_at", "id"),
+    )
+
 class Message(Base):
     __tablename__ = "messages"
 
@@ -34,4 +39,58 @@ class Message(Base):
     content = Column(Text) # El texto del mensaje
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
-    conversation = relationship("Conversation", back_populates="messages")
\ No newline at end of file
+    conversation = relationship("Conversation", back_populates="messages")
+
+    # Índice para leer los últimos mensajes de una conversación sin ordenar en memoria
+    __table_args__ = (
+        Index("ix_messages_conversation_created", "conversation_id", "created_at", "id"),
+    )
+
+class Blob(Base):
+    """Contenido de un adjunto, guardado en disco por su SHA-256 (ver blob_store)."""
+    __tablename__ = "blobs"
+
+    hash = Column(String(64), primary_key=True)
+    size = Column(BigInteger)
+    ref_count = Column(Integer, default=0)  # Elementos que lo usan; a 0 se borra el fichero
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class Element(Base):
+    """Adjunto de Chainlit (imagen, fichero...) de una conversación. Solo metadatos."""
+    __tablename__ = "elements"
+
+    id = Column(String, primary_key=True)  # Id que asigna Chainlit (uuid)
+    conversation_id = Column(Integer, ForeignKey("conversations.id"), index=True)
+    for_id = Column(String, nullable=True)  # Step (mensaje) al que va asociado
+    blob_hash = Column(String(64), ForeignKey("blobs.hash"), nullable=True)
+    url = Column(String, nullable=True)  # Solo para elementos externos (sin blob)
+    type = Column(String)
+    name = Column(String)
+    mime = Column(String, nullable=True)
+    display = Column(String, nullable=True)
+    size = Column(String, nullable=True)  # Tamaño de visualización de Chainlit (small/medium/large)
+    language = Column(String, nullable=True)
+    page = Column(Integer, nullable=True)
+    props = Column(Text, nullable=True)  # JSON
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ArchivedConversation(Base):
+    """Mensajes de una conversación inactiva, comprimidos en una sola fila (ver src/db/archive.py)."""
+    __tablename__ = "archived_conversations"
+
+    conversation_id = Column(Integer, ForeignKey("conversations.id"), primary_key=True)
+    data = Column(LargeBinary)  # JSON comprimido con zlib: [[id, rol, contenido, fecha], ...]
+    message_count = Column(Integer)
+    raw_size = Column(BigInteger)  # Bytes del JSON sin comprimir
+    compressed_size = Column(BigInteger)
+    last_message_at = Column(DateTime(timezone=True))
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+def create_missing_indexes(sync_conn):
+    """
+    create_all no añade índices a tablas que ya existen.
+    Esta función los crea en bases de datos anteriores (si faltan).
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
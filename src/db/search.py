@@ -0,0 +1,313 @@
+"""Búsqueda de texto completo sobre el historial (SQLite FTS5).
+
+Dos índices FTS5 de contenido externo: uno sobre messages.content y otro
+sobre conversations.title. Los triggers los mantienen al día en cada
+INSERT/UPDATE/DELETE, así que da igual por dónde se escriba (crud, cola de
+escritura, update_thread). Un tercer índice, archived_fts, guarda el texto
+de las conversaciones archivadas (una fila por conversación): lo rellena el
+job de archivo y un trigger lo limpia al rehidratar o borrar. Para bases de
+datos anteriores:
+
+    python -m src.db.search rebuild
+
+Con otro motor (o un SQLite sin FTS5) la búsqueda cae a un ILIKE sobre el título.
+"""
+
+import asyncio
+import re
+from sqlalchemy import DateTime, literal, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.future import select
+from src.db.database import engine, read_session
+from src.db.models import Conversation
+from src.metrics import db_query_seconds, timed
+
+# unicode61 + remove_diacritics: "cancion" encuentra "canción"
+_TOKENIZE = "tokenize='unicode61 remove_diacritics 2'"
+
+# Cada fila lleva un token de propietario ('u<id>'): el filtro por usuario se
+# resuelve dentro del índice en lugar de recorrer los aciertos de todos.
+_OWNER_OF_MESSAGE = "(SELECT 'u' || user_id FROM conversations WHERE id = {row}.conversation_id)"
+
+_DDL = [
+    # Vistas de contenido: de aquí lee FTS5 para 'rebuild', snippet() y highlight()
+    """CREATE VIEW IF NOT EXISTS messages_fts_source AS
+        SELECT m.id AS id, m.content AS content, 'u' || c.user_id AS owner
+        FROM messages m JOIN conversations c ON c.id = m.conversation_id""",
+    """CREATE VIEW IF NOT EXISTS conversations_fts_source AS
+        SELECT id, title, 'u' || user_id AS owner FROM conversations""",
+
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+    f"content, owner, content='messages_fts_source', content_rowid='id', {_TOKENIZE})",
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts USING fts5("
+    f"title, owner, content='conversations_fts_source', content_rowid='id', {_TOKENIZE})",
+
+    f"""CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, content, owner)
+        VALUES (new.id, new.content, {_OWNER_OF_MESSAGE.format(row="new")});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content, owner)
+        VALUES ('delete', old.id, old.content, {_OWNER_OF_MESSAGE.format(row="old")});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content, owner)
+        VALUES ('delete', old.id, old.content, {_OWNER_OF_MESSAGE.format(row="old")});
+        INSERT INTO messages_fts(rowid, content, owner)
+        VALUES (new.id, new.content, {_OWNER_OF_MESSAGE.format(row="new")});
+    END""",
+
+    """CREATE TRIGGER IF NOT EXISTS conversations_fts_ai AFTER INSERT ON conversations BEGIN
+        INSERT INTO conversations_fts(rowid, title, owner) VALUES (new.id, new.title, 'u' || new.user_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS conversations_fts_ad AFTER DELETE ON conversations BEGIN
+        INSERT INTO conversations_fts(conversations_fts, rowid, title, owner)
+        VALUES ('delete', old.id, old.title, 'u' || old.user_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS conversations_fts_au AFTER UPDATE OF title ON conversations BEGIN
+        INSERT INTO conversations_fts(conversations_fts, rowid, title, owner)
+        VALUES ('delete', old.id, old.title, 'u' || old.user_id);
+        INSERT INTO conversations_fts(rowid, title, owner) VALUES (new.id, new.title, 'u' || new.user_id);
+    END""",
+]
+
+# Conversaciones archivadas: su texto sale de un blob comprimido, así que no hay tabla
+# de contenido posible; el índice guarda el texto y se rellena desde Python (archive.py)
+_ARCHIVED_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS archived_fts USING fts5(content, owner, {_TOKENIZE})",
+    """CREATE TRIGGER IF NOT EXISTS archived_fts_ad AFTER DELETE ON archived_conversations BEGIN
+        DELETE FROM archived_fts WHERE rowid = old.conversation_id;
+    END""",
+]
+
+_INDEX_ARCHIVED_SQL = text("""
+    INSERT INTO archived_fts(rowid, content, owner)
+    SELECT id, :content, 'u' || user_id FROM conversations WHERE id = :conversation_id
+""")
+
+# Un acierto en el título pesa más que uno en un mensaje (bm25: más negativo = mejor)
+TITLE_WEIGHT = 2.0
+
+_SEARCH_TEMPLATE = """
+    WITH hits AS (
+        SELECT c.id AS conversation_id,
+               bm25(conversations_fts, 1.0, 0.0) * :title_weight AS rank,
+               snippet(conversations_fts, 0, '[', ']', '…', 12) AS snippet
+        FROM conversations_fts
+        JOIN conversations c ON c.id = conversations_fts.rowid
+        WHERE conversations_fts MATCH :title_query AND c.user_id = :user_id
+        UNION ALL
+        SELECT m.conversation_id,
+               bm25(messages_fts, 1.0, 0.0),
+               snippet(messages_fts, 0, '[', ']', '…', 12)
+        FROM messages_fts
+        JOIN messages m ON m.id = messages_fts.rowid
+        JOIN conversations c ON c.id = m.conversation_id
+        WHERE messages_fts MATCH :content_query AND c.user_id = :user_id
+        {archived_hits}
+    )
+    -- Con MIN(), SQLite devuelve el snippet de la fila con mejor rank del grupo
+    SELECT h.conversation_id, MIN(h.rank) AS rank, h.snippet, c.title, c.created_at
+    FROM hits h
+    JOIN conversations c ON c.id = h.conversation_id
+    GROUP BY h.conversation_id
+    ORDER BY rank, h.conversation_id DESC
+    LIMIT :limit OFFSET :offset
+"""
+
+_ARCHIVED_HITS = """
+        UNION ALL
+        SELECT c.id,
+               bm25(archived_fts, 1.0, 0.0),
+               snippet(archived_fts, 0, '[', ']', '…', 12)
+        FROM archived_fts
+        JOIN conversations c ON c.id = archived_fts.rowid
+        WHERE archived_fts MATCH :content_query AND c.user_id = :user_id"""
+
+# Con y sin archived_fts: una base sin la migración v5 (p. ej. creada con create_all) sigue buscando
+_SEARCH_SQL = {
+    with_archived: text(_SEARCH_TEMPLATE.format(archived_hits=_ARCHIVED_HITS if with_archived else ""))
+    .columns(created_at=DateTime(timezone=True))
+    for with_archived in (True, False)
+}
+
+_fts_ready = None
+_archived_fts_ready = None
+
+
+def create_search_index(sync_conn) -> bool:
+    """
+    Crea las tablas FTS5 y sus triggers si faltan (lifespan de FastAPI).
+    Si el índice es nuevo y ya había datos, lo reconstruye.
+    """
+    global _fts_ready
+    if sync_conn.dialect.name != "sqlite":
+        _fts_ready = False
+        return False
+
+    existed = sync_conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+    ).first() is not None
+    try:
+        for statement in _DDL:
+            sync_conn.exec_driver_sql(statement)
+    except OperationalError as e:
+        print(f"FTS5 no disponible, la búsqueda usará solo el título: {e}")
+        _fts_ready = False
+        return False
+
+    if not existed:
+        rebuild_search_index(sync_conn)
+    _fts_ready = True
+    return True
+
+
+def rebuild_search_index(sync_conn):
+    """Reindexa todos los mensajes y títulos desde las tablas de contenido."""
+    sync_conn.exec_driver_sql("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+    sync_conn.exec_driver_sql("INSERT INTO conversations_fts(conversations_fts) VALUES ('rebuild')")
+
+
+def create_archived_search_index(sync_conn) -> bool:
+    """Crea el índice de conversaciones archivadas (si hay FTS5) e indexa las que ya lo estén."""
+    global _archived_fts_ready
+    if sync_conn.dialect.name != "sqlite":
+        return False
+    # Sin FTS5 (la v3 no pudo crear messages_fts) no hay búsqueda que ampliar
+    if sync_conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+    ).first() is None:
+        return False
+    for statement in _ARCHIVED_DDL:
+        sync_conn.exec_driver_sql(statement)
+    reindex_archived(sync_conn)
+    _archived_fts_ready = True
+    return True
+
+
+def reindex_archived(sync_conn, batch_size: int = 100):
+    """Vuelve a indexar el texto de todas las conversaciones archivadas, por lotes."""
+    from src.db.archive import decode
+    sync_conn.exec_driver_sql("DELETE FROM archived_fts")
+    after_id = 0
+    while True:
+        rows = sync_conn.execute(
+            text(
+                "SELECT conversation_id, data FROM archived_conversations "
+                "WHERE conversation_id > :after_id ORDER BY conversation_id LIMIT :limit"
+            ),
+            {"after_id": after_id, "limit": batch_size},
+        ).all()
+        if not rows:
+            break
+        after_id = rows[-1].conversation_id
+        sync_conn.execute(_INDEX_ARCHIVED_SQL, [
+            {"conversation_id": row.conversation_id, "content": archived_text(decode(row.data))}
+            for row in rows
+        ])
+
+
+def archived_text(messages: list) -> str:
+    """Texto indexable de una conversación archivada: el contenido de sus mensajes."""
+    return "\n".join(m.content for m in messages if m.content)
+
+
+async def index_archived(session, texts: dict):
+    """Indexa {conversation_id: texto} en archived_fts dentro de la transacción del llamador."""
+    if texts and await _is_archived_ready(session):
+        await session.execute(_INDEX_ARCHIVED_SQL, [
+            {"conversation_id": conversation_id, "content": content}
+            for conversation_id, content in texts.items()
+        ])
+
+
+async def _has_table(session, name: str) -> bool:
+    if session.bind.dialect.name != "sqlite":
+        return False
+    result = await session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": name}
+    )
+    return result.first() is not None
+
+
+async def _is_ready(session) -> bool:
+    global _fts_ready
+    if _fts_ready is None:
+        _fts_ready = await _has_table(session, "messages_fts")
+    return _fts_ready
+
+
+async def _is_archived_ready(session) -> bool:
+    global _archived_fts_ready
+    if _archived_fts_ready is None:
+        _archived_fts_ready = await _has_table(session, "archived_fts")
+    return _archived_fts_ready
+
+
+def build_match_query(search: str):
+    """
+    Convierte lo que escribe el usuario en una consulta FTS5 segura:
+    cada palabra entre comillas (sin operadores) y la última como prefijo.
+    'hola mun' -> '"hola" "mun"*'
+    """
+    terms = re.findall(r"\w+", search)
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+@timed(db_query_seconds, "search.search_conversations")
+async def search_conversations(user_id: int, search: str, limit: int = 20, offset: int = 0):
+    """
+    Conversaciones del usuario que coinciden con 'search', de más a menos relevante.
+    Devuelve (resultados, hay_más). Cada resultado: conversation_id, title,
+    created_at, snippet (fragmento con los términos entre corchetes) y rank.
+    """
+    async with read_session() as session:
+        if await _is_ready(session):
+            terms = build_match_query(search)
+            if terms is None:
+                return [], False
+            owner = f'owner:"u{int(user_id)}"'
+            result = await session.execute(_SEARCH_SQL[await _is_archived_ready(session)], {
+                "title_query": f"{owner} AND title:({terms})",
+                "content_query": f"{owner} AND content:({terms})",
+                "user_id": user_id, "title_weight": TITLE_WEIGHT,
+                "limit": limit + 1, "offset": offset,
+            })
+        else:
+            result = await session.execute(
+                select(
+                    Conversation.id.label("conversation_id"),
+                    literal(0.0).label("rank"),
+                    literal(None).label("snippet"),
+                    Conversation.title,
+                    Conversation.created_at,
+                )
+                .filter(Conversation.user_id == user_id, Conversation.title.ilike(f"%{search}%"))
+                .order_by(Conversation.created_at.desc(), Conversation.id.desc())
+                .limit(limit + 1)
+                .offset(offset)
+            )
+        rows = result.mappings().all()
+
+    return [dict(row) for row in rows[:limit]], len(rows) > limit
+
+
+async def _rebuild():
+    async with engine.begin() as conn:
+        ready = await conn.run_sync(create_search_index)
+        if ready:
+            await conn.run_sync(rebuild_search_index)
+            await conn.run_sync(create_archived_search_index)
+    await engine.dispose()
+    print("Índice de búsqueda reconstruido." if ready else "Este motor no admite FTS5; nada que hacer.")
+
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:] != ["rebuild"]:
+        raise SystemExit("Uso: python -m src.db.search rebuild")
+    asyncio.run(_rebuild())
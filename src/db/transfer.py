@@ -0,0 +1,312 @@
+"""Exportación e importación de historiales en NDJSON (una línea JSON por registro).
+
+Formato: una cabecera y, por cada conversación, su línea seguida de sus mensajes:
+
+    {"type": "header", "format": "chat-export", "version": 1, "exported_at": "..."}
+    {"type": "conversation", "id": 7, "title": "...", "created_at": "..."}
+    {"type": "message", "conversation_id": 7, "role": "user", "content": "...", "created_at": "..."}
+
+La exportación lee con un cursor (session.stream + yield_per) y la importación
+procesa la entrada línea a línea e inserta por lotes: la memoria no depende
+del tamaño del historial. Las conversaciones importadas reciben ids nuevos y
+pasan a ser del usuario que importa. Los adjuntos no se incluyen (sus
+ficheros viven en el almacén de blobs).
+
+Sin pasar por HTTP:
+
+    python -m src.db.transfer export <user_id> historial.ndjson.gz
+    python -m src.db.transfer import <user_id> historial.ndjson.gz
+"""
+
+import asyncio
+import json
+import zlib
+from datetime import datetime, timezone
+from sqlalchemy import insert
+from sqlalchemy.future import select
+from src.config import settings
+from src.db.database import async_session, read_session
+from src.db.archive import decode
+from src.db.models import ArchivedConversation, Conversation, Message
+from src.metrics import db_query_seconds, timed
+
+FORMAT = "chat-export"
+VERSION = 1
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_OUTPUT_CHUNK = 65536  # Bytes acumulados antes de entregar un trozo de la respuesta
+_MAX_ERRORS = 20  # Errores de línea que se devuelven en el informe
+
+
+class TransferError(Exception):
+    """La entrada no se puede leer (gzip corrupto, línea demasiado larga...)."""
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def _parse_datetime(value):
+    if not value:
+        return datetime.now(timezone.utc)
+    return datetime.fromisoformat(value)
+
+
+def _dumps(record: dict) -> bytes:
+    return json.dumps(record, ensure_ascii=False).encode() + b"\n"
+
+
+# --- Exportación ---
+async def export_records(user_id: int):
+    """Genera los registros (dicts) del historial de un usuario, en orden."""
+    yield {
+        "type": "header",
+        "format": FORMAT,
+        "version": VERSION,
+        "exported_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+    # El orden coincide con ix_conversations_user_created y ix_messages_conversation_created:
+    # SQLite recorre los índices sin ordenar el resultado en una tabla temporal
+    stmt = (
+        select(
+            Conversation.id,
+            Conversation.title,
+            Conversation.created_at,
+            Message.role,
+            Message.content,
+            Message.created_at.label("message_created_at"),
+            ArchivedConversation.data.label("archived"),
+        )
+        .outerjoin(Message, Message.conversation_id == Conversation.id)
+        .outerjoin(ArchivedConversation, ArchivedConversation.conversation_id == Conversation.id)
+        .filter(Conversation.user_id == user_id)
+        .order_by(Conversation.created_at, Conversation.id, Message.created_at, Message.id)
+        .execution_options(yield_per=settings.TRANSFER_BATCH_SIZE)
+    )
+
+    current = None
+    async with read_session() as session:
+        result = await session.stream(stmt)
+        async for rows in result.partitions():
+            for row in rows:
+                if row.id != current:
+                    current = row.id
+                    yield {
+                        "type": "conversation",
+                        "id": row.id,
+                        "title": row.title,
+                        "created_at": _isoformat(row.created_at),
+                    }
+                    # Conversación archivada: sus mensajes (más antiguos) van antes que los de 'messages'
+                    if row.archived is not None:
+                        for message in decode(row.archived):
+                            yield {
+                                "type": "message",
+                                "conversation_id": row.id,
+                                "role": message.role,
+                                "content": message.content,
+                                "created_at": _isoformat(message.created_at),
+                            }
+                if row.role is not None:
+                    yield {
+                        "type": "message",
+                        "conversation_id": row.id,
+                        "role": row.role,
+                        "content": row.content,
+                        "created_at": _isoformat(row.message_created_at),
+                    }
+
+
+async def export_ndjson(user_id: int, compress: bool = False):
+    """Genera el NDJSON en trozos de ~64 KiB (comprimidos con gzip si se pide)."""
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    buffer = bytearray()
+    async for record in export_records(user_id):
+        buffer += _dumps(record)
+        if len(buffer) >= _OUTPUT_CHUNK:
+            chunk = compressor.compress(bytes(buffer)) if compressor else bytes(buffer)
+            buffer.clear()
+            if chunk:
+                yield chunk
+    tail = compressor.compress(bytes(buffer)) + compressor.flush() if compressor else bytes(buffer)
+    if tail:
+        yield tail
+
+
+# --- Importación ---
+async def _iter_lines(chunks):
+    """Parte un flujo de bytes (NDJSON o NDJSON.gz) en líneas, sin leerlo entero."""
+    decompressor = None
+    first = True
+    pending = b""
+    async for chunk in chunks:
+        if first and chunk:
+            first = False
+            # gzip se detecta por los bytes mágicos, con o sin Content-Encoding
+            if chunk.startswith(_GZIP_MAGIC):
+                decompressor = zlib.decompressobj(wbits=31)
+        if decompressor is not None:
+            data, chunk = chunk, b""
+            try:
+                while data:
+                    chunk += decompressor.decompress(data)
+                    data = decompressor.unused_data
+                    # gzip con varios miembros (p. ej. ficheros concatenados): uno nuevo por miembro
+                    if data:
+                        decompressor = zlib.decompressobj(wbits=31)
+            except zlib.error as e:
+                raise TransferError(f"gzip no válido: {e}") from e
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+        if len(pending) > settings.TRANSFER_MAX_LINE_BYTES:
+            raise TransferError(f"Línea de más de {settings.TRANSFER_MAX_LINE_BYTES} bytes")
+    if decompressor is not None and not decompressor.eof:
+        raise TransferError("gzip incompleto")
+    if pending:
+        yield pending
+
+
+class _Importer:
+    """Acumula registros y los inserta por lotes, una transacción por lote."""
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        # Los mensajes siguen a su conversación: basta recordar la última (id en el fichero
+        # y, una vez insertada, id nuevo), no un mapa de todo el historial
+        self.current_id = None
+        self.current_new_id = None
+        self.conversations = []  # filas pendientes
+        self.messages = []  # (índice en 'conversations' o -1 si ya está insertada, fila)
+        self.report = {"conversations": 0, "messages": 0, "skipped": 0, "errors": []}
+
+    def skip(self, line_number: int, reason: str):
+        self.report["skipped"] += 1
+        if len(self.report["errors"]) < _MAX_ERRORS:
+            self.report["errors"].append(f"línea {line_number}: {reason}")
+
+    def add(self, line_number: int, record: dict):
+        kind = record.get("type")
+        if kind == "conversation":
+            # Si la línea no es válida, sus mensajes tampoco deben ir a la conversación anterior
+            self.current_id = None
+            conversation_id = record["id"]
+            self.conversations.append({
+                "user_id": self.user_id,
+                "title": record.get("title") or "Nueva Conversación",
+                "created_at": _parse_datetime(record.get("created_at")),
+            })
+            self.current_id = conversation_id
+        elif kind == "message":
+            if self.current_id is None or record["conversation_id"] != self.current_id:
+                self.skip(line_number, f"mensaje fuera de su conversación ({record['conversation_id']})")
+                return
+            self.messages.append((len(self.conversations) - 1, {
+                "role": record["role"],
+                "content": record.get("content") or "",
+                "created_at": _parse_datetime(record.get("created_at")),
+            }))
+        elif kind == "header":
+            if record.get("format") != FORMAT or record.get("version") != VERSION:
+                raise TransferError(f"Formato no admitido: {record.get('format')} v{record.get('version')}")
+        else:
+            self.skip(line_number, f"tipo desconocido {kind!r}")
+
+    @property
+    def pending(self) -> int:
+        return len(self.conversations) + len(self.messages)
+
+    @timed(db_query_seconds, "transfer.import_batch")
+    async def flush(self):
+        if not self.pending:
+            return
+        conversations, self.conversations = self.conversations, []
+        messages, self.messages = self.messages, []
+
+        async with async_session() as session:
+            # 1. Conversaciones: un INSERT multi-fila que devuelve los ids en el mismo orden
+            new_ids = []
+            if conversations:
+                result = await session.execute(
+                    insert(Conversation).returning(Conversation.id, sort_by_parameter_order=True),
+                    conversations,
+                )
+                new_ids = list(result.scalars())
+
+            # 2. Mensajes: executemany con el id nuevo de su conversación
+            rows = [
+                {**row, "conversation_id": new_ids[index] if index >= 0 else self.current_new_id}
+                for index, row in messages
+            ]
+            if rows:
+                await session.execute(insert(Message), rows)
+            await session.commit()
+
+        if new_ids:
+            self.current_new_id = new_ids[-1]
+        self.report["conversations"] += len(conversations)
+        self.report["messages"] += len(rows)
+
+
+async def import_ndjson(user_id: int, chunks) -> dict:
+    """
+    Importa un historial (iterable asíncrono de bytes) a la cuenta de 'user_id'.
+    Las líneas defectuosas se omiten y se cuentan en el informe. Si la entrada
+    deja de poder leerse a mitad, lo ya leído queda importado y el informe
+    lleva el motivo en 'error'.
+    """
+    importer = _Importer(user_id)
+    line_number = 0
+    try:
+        async for line in _iter_lines(chunks):
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                importer.add(line_number, record)
+            except TransferError:
+                raise
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                importer.skip(line_number, f"registro no válido ({e})")
+                continue
+            if importer.pending >= settings.TRANSFER_BATCH_SIZE:
+                await importer.flush()
+    except TransferError as e:
+        importer.report["error"] = str(e)
+    await importer.flush()
+    return importer.report
+
+
+# --- CLI ---
+async def _read_file(path: str):
+    with open(path, "rb") as source:
+        while chunk := await asyncio.to_thread(source.read, _OUTPUT_CHUNK):
+            yield chunk
+
+
+async def _export_file(user_id: int, path: str):
+    with open(path, "wb") as target:
+        async for chunk in export_ndjson(user_id, compress=path.endswith(".gz")):
+            await asyncio.to_thread(target.write, chunk)
+
+
+async def _main(command: str, user_id: int, path: str):
+    from src.db.database import dispose_engines
+    try:
+        if command == "export":
+            await _export_file(user_id, path)
+            print(f"Historial del usuario {user_id} exportado a {path}")
+        else:
+            print(json.dumps(await import_ndjson(user_id, _read_file(path)), ensure_ascii=False, indent=2))
+    finally:
+        await dispose_engines()
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 4 or sys.argv[1] not in ("export", "import"):
+        raise SystemExit("Uso: python -m src.db.transfer export|import <user_id> <fichero[.gz]>")
+    asyncio.run(_main(sys.argv[1], int(sys.argv[2]), sys.argv[3]))
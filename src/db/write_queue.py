@@ -0,0 +1,154 @@
+"""Persistencia diferida (write-behind) con commit agrupado.
+
+El handler del chat no escribe en la DB directamente: encola las escrituras
+y un escritor en segundo plano las vuelca en una sola transacción por
+intervalo, mezclando mensajes de muchas conversaciones.
+"""
+
+import asyncio
+from collections import Counter
+from datetime import datetime, timezone
+from sqlalchemy import update
+from src.config import settings
+from src.db.database import async_session
+from src.db.identity_cache import invalidate_thread
+from src.db.models import Conversation, Message
+from src.metrics import db_query_seconds, timed
+
+
+class PersistenceQueue:
+    def __init__(self, flush_interval_ms: int = None, max_batch: int = None):
+        if flush_interval_ms is None:
+            flush_interval_ms = settings.PERSIST_FLUSH_INTERVAL_MS
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch if max_batch is not None else settings.PERSIST_MAX_BATCH
+
+        self._ops = []                 # Operaciones pendientes, en orden de llegada
+        self._pending_by_conv = Counter()
+        self._flush_waiters = []
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+
+    # --- API para el chat ---
+    def add_message(self, conversation_id: int, role: str, content: str):
+        """Encola un mensaje. La fecha se fija ahora, no al volcarlo."""
+        self._enqueue(conversation_id, ("message", {
+            "conversation_id": conversation_id,
+            "role": role,
+            "content": content,
+            "created_at": datetime.now(timezone.utc),
+        }))
+
+    def rename_conversation(self, conversation_id: int, title: str):
+        """Encola el cambio de título de una conversación."""
+        self._enqueue(conversation_id, ("rename", {"id": conversation_id, "title": title}))
+        invalidate_thread(conversation_id)
+
+    async def wait_for(self, conversation_id: int):
+        """Read-your-writes: espera a que lo pendiente de esa conversación esté en la DB."""
+        if self._pending_by_conv.get(conversation_id):
+            await self.flush()
+
+    async def flush(self):
+        """Fuerza un volcado inmediato y espera a que termine."""
+        if not self._ops:
+            return
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        self._flush_waiters.append(future)
+        self._wakeup.set()
+        await future
+
+    @property
+    def pending(self) -> int:
+        return len(self._ops)
+
+    # --- Ciclo de vida ---
+    def start(self):
+        self._ensure_started()
+
+    async def stop(self):
+        """Vuelca todo lo pendiente y detiene el escritor (lifespan de FastAPI)."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        self._stopping = False
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def _enqueue(self, conversation_id: int, op: tuple):
+        self._ops.append((conversation_id, op))
+        self._pending_by_conv[conversation_id] += 1
+        self._ensure_started()
+        if len(self._ops) >= self.max_batch:
+            self._wakeup.set()
+
+    # --- Escritor ---
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            # Si alguien espera un flush (o estamos apagando), se vacía la cola completa
+            while self._ops:
+                await self._write_batch()
+                if not self._flush_waiters and not self._stopping:
+                    break
+            self._resolve_waiters()
+            if self._stopping:
+                return
+
+    async def _write_batch(self):
+        batch = self._ops[:self.max_batch]
+        try:
+            await self._commit(batch)
+        except Exception as e:
+            # Un registro defectuoso no debe tirar el lote entero: reintento uno a uno
+            print(f"Error volcando lote de {len(batch)} escrituras: {e}")
+            for item in batch:
+                try:
+                    await self._commit([item])
+                except Exception as item_error:
+                    print(f"Escritura descartada para la conversación {item[0]}: {item_error}")
+
+        del self._ops[:len(batch)]
+        for conversation_id, _ in batch:
+            self._pending_by_conv[conversation_id] -= 1
+            if self._pending_by_conv[conversation_id] <= 0:
+                del self._pending_by_conv[conversation_id]
+
+    @timed(db_query_seconds, "write_queue.commit")
+    async def _commit(self, batch: list):
+        messages = [data for _, (kind, data) in batch if kind == "message"]
+        # Varios renombrados de la misma conversación: gana el último
+        renames = {data["id"]: data["title"] for _, (kind, data) in batch if kind == "rename"}
+
+        async with async_session() as session:
+            if messages:
+                session.add_all([Message(**data) for data in messages])
+            for conversation_id, title in renames.items():
+                await session.execute(
+                    update(Conversation)
+                    .where(Conversation.id == conversation_id)
+                    .values(title=title)
+                )
+            await session.commit()
+
+    def _resolve_waiters(self):
+        waiters, self._flush_waiters = self._flush_waiters, []
+        for future in waiters:
+            if not future.done():
+                future.set_result(None)
+
+
+persistence_queue = PersistenceQueue()
@@ -0,0 +1,172 @@
+"""Métricas en formato de texto de Prometheus, sin dependencias externas.
+
+Contadores, gauges e histogramas con etiquetas. Observar un valor es una
+búsqueda binaria y unas sumas, así que se puede usar en rutas calientes;
+aun así, en el streaming se mide una vez por stream, no por token.
+"""
+
+import functools
+import time
+from bisect import bisect_left
+
+# Buckets por defecto (segundos)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STREAM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+RATE_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500)
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        _registry.append(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self._children.items():
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {child.value}"]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames=(), collect=None):
+        """'collect' (opcional) devuelve {valores_de_etiquetas: valor} al exportar."""
+        super().__init__(name, help, labelnames)
+        self._collect = collect
+
+    def render(self) -> list:
+        if self._collect is not None:
+            for values, value in self._collect().items():
+                self.labels(*values).set(value)
+        return super().render()
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def _render_child(self, values, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            labels = _format_labels(self.labelnames, values, 'le="' + le + '"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {child.sum}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+def timed(histogram: Histogram, *label_values):
+    """Decorador para corrutinas: observa su duración en el histograma."""
+    child = histogram.labels(*label_values)
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Métricas de la aplicación ---
+llm_ttft_seconds = Histogram(
+    "llm_time_to_first_token_seconds", "Tiempo hasta el primer token", ("provider", "model")
+)
+llm_stream_seconds = Histogram(
+    "llm_stream_duration_seconds", "Duración total del stream", ("provider", "model"), STREAM_BUCKETS
+)
+llm_tokens_per_second = Histogram(
+    "llm_tokens_per_second", "Tokens (chunks) por segundo tras el primer token", ("provider", "model"), RATE_BUCKETS
+)
+llm_active_streams = Gauge("llm_active_streams", "Streams LLM en curso", ("provider", "model"))
+llm_queue_wait_seconds = Histogram(
+    "llm_queue_wait_seconds", "Espera en la cola de admisión", ("provider", "model"), STREAM_BUCKETS
+)
+db_query_seconds = Histogram("db_query_duration_seconds", "Latencia de operaciones de DB", ("operation",))
+auth_seconds = Histogram("auth_duration_seconds", "Latencia de hashing/verificación de contraseñas", ("operation",))
+archive_conversations_total = Counter(
+    "archive_conversations_total", "Conversaciones archivadas y rehidratadas", ("operation",)
+)
+archive_bytes_total = Counter("archive_bytes_total", "Bytes de mensajes archivados (sin comprimir y comprimidos)", ("kind",))
@@ -0,0 +1,47 @@
+import os
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from fastapi.responses import FileResponse
+from chainlit.auth import get_current_user
+from sqlalchemy.future import select
+from src.db.blob_store import blob_store
+from src.db.database import read_session
+from src.db.models import Conversation, Element
+
+router = APIRouter()
+
+@router.get("/elements/{element_id}")
+async def download_element(element_id: str, request: Request, current_user = Depends(get_current_user)):
+    # 1. Solo usuarios autenticados
+    if current_user is None or "id" not in (current_user.metadata or {}):
+        raise HTTPException(status_code=401, detail="No autenticado")
+
+    # 2. El adjunto debe ser de una conversación del usuario
+    async with read_session() as session:
+        result = await session.execute(
+            select(Element.blob_hash, Element.name, Element.mime, Conversation.user_id)
+            .join(Conversation, Conversation.id == Element.conversation_id)
+            .filter(Element.id == element_id)
+        )
+        element = result.first()
+    if element is None or not element.blob_hash or element.user_id != int(current_user.metadata["id"]):
+        raise HTTPException(status_code=404, detail="Adjunto no encontrado")
+
+    path = blob_store.path_for(element.blob_hash)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Adjunto no encontrado")
+
+    # 3. El contenido nunca cambia (la ruta es su hash): caché del navegador sin límite
+    etag = f'"{element.blob_hash}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=31536000, immutable"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    # FileResponse lee del disco por bloques (o usa pathsend si el servidor lo admite)
+    # y atiende cabeceras Range: vídeos y PDFs grandes se sirven a trozos
+    return FileResponse(
+        path,
+        media_type=element.mime or "application/octet-stream",
+        filename=element.name,
+        content_disposition_type="inline",
+        headers=headers,
+    )
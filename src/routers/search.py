@@ -0,0 +1,34 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from chainlit.auth import get_current_user
+from src.db.search import search_conversations
+
+router = APIRouter()
+
+@router.get("/search")
+async def search(
+    q: str = Query(..., min_length=1, description="Texto a buscar en títulos y mensajes"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    current_user = Depends(get_current_user),
+):
+    # 1. Solo usuarios autenticados (misma sesión/JWT que la UI de Chainlit)
+    if current_user is None or "id" not in (current_user.metadata or {}):
+        raise HTTPException(status_code=401, detail="No autenticado")
+
+    # 2. Búsqueda limitada a las conversaciones del propio usuario
+    results, has_more = await search_conversations(int(current_user.metadata["id"]), q, limit, offset)
+
+    return {
+        "query": q,
+        "results": [
+            {
+                "conversation_id": row["conversation_id"],
+                "title": row["title"],
+                "snippet": row["snippet"],
+                "created_at": row["created_at"].isoformat() if row["created_at"] else None,
+                "score": -row["rank"],
+            }
+            for row in results
+        ],
+        "next_offset": offset + len(results) if has_more else None,
+    }
@@ -0,0 +1,32 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from chainlit.auth import get_current_user
+from src.db.chainlit_data_layer import CustomDataLayer
+
+router = APIRouter()
+data_layer = CustomDataLayer()
+
+@router.get("/threads/{thread_id}/steps")
+async def older_steps(
+    thread_id: str,
+    before: str = Query(..., description="Id del step más antiguo que ya tiene el cliente (oldestStepId)"),
+    limit: int = Query(100, ge=1, le=500),
+    current_user = Depends(get_current_user),
+):
+    # 1. Solo usuarios autenticados
+    if current_user is None or "id" not in (current_user.metadata or {}):
+        raise HTTPException(status_code=401, detail="No autenticado")
+
+    # 2. La conversación debe ser del usuario (mismo 404 si no existe, para no revelar ids ajenos)
+    if await data_layer.get_thread_author(thread_id) != str(current_user.metadata["id"]):
+        raise HTTPException(status_code=404, detail="Conversación no encontrada")
+
+    # 3. Un step de más indica si quedan páginas anteriores
+    steps = await data_layer.get_older_steps(thread_id, before, limit + 1)
+    has_older_steps = len(steps) > limit
+    steps = steps[-limit:]
+
+    return {
+        "steps": steps,
+        "hasOlderSteps": has_older_steps,
+        "oldestStepId": data_layer.step_cursor(steps[0]) if steps else None,
+    }
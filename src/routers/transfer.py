@@ -0,0 +1,43 @@
+from datetime import datetime, timezone
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from chainlit.auth import get_current_user
+from src.db.transfer import export_ndjson, import_ndjson
+
+router = APIRouter()
+
+def _user_id(current_user) -> int:
+    if current_user is None or "id" not in (current_user.metadata or {}):
+        raise HTTPException(status_code=401, detail="No autenticado")
+    return int(current_user.metadata["id"])
+
+@router.get("/export")
+async def export_history(
+    compress: bool = Query(False, description="Descargar comprimido con gzip (.ndjson.gz)"),
+    current_user = Depends(get_current_user),
+):
+    # 1. Solo usuarios autenticados, y solo su propio historial
+    user_id = _user_id(current_user)
+
+    # 2. La respuesta se genera mientras se lee la DB: nunca está entera en memoria
+    filename = f"historial-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.ndjson"
+    if compress:
+        filename += ".gz"
+    return StreamingResponse(
+        export_ndjson(user_id, compress=compress),
+        media_type="application/gzip" if compress else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@router.post("/import")
+async def import_history(request: Request, current_user = Depends(get_current_user)):
+    # 1. Solo usuarios autenticados: lo importado pasa a ser suyo
+    user_id = _user_id(current_user)
+
+    # 2. El cuerpo (NDJSON, en claro o gzip) se procesa a medida que llega
+    report = await import_ndjson(user_id, request.stream())
+
+    # 3. Entrada ilegible a mitad: 400, pero con el informe de lo que sí se importó
+    if "error" in report:
+        return JSONResponse({"detail": report["error"], **report}, status_code=400)
+    return report
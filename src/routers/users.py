@@ -1,10 +1,11 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.future import select
-from sqlalchemy.ext.asyncio import AsyncSession
-from src.db.database import get_db
+from src.db.database import async_session, read_session
 from src.db.models import User
-from src.auth.utils import get_password_hash
+from src.auth.utils import aget_password_hash
+from src.db.identity_cache import invalidate_user
 
 router = APIRouter()
 
@@ -14,20 +15,26 @@ class UserCreate(BaseModel):
     password: str
 
 @router.post("/register")
-async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
-    # 1. Verificar si el usuario ya existe
-    result = await db.execute(select(User).filter(User.email == user.email))
-    existing_user = result.scalars().first()
+async def register(user: UserCreate):
+    # 1. Verificar si el usuario ya existe (en un lector: el escritor de SQLite es único)
+    async with read_session() as session:
+        result = await session.execute(select(User.id).filter(User.email == user.email))
+        existing_user = result.first()
     
     if existing_user:
         raise HTTPException(status_code=400, detail="El email ya está registrado")
     
-    # 2. Crear usuario con contraseña hasheada
-    hashed_pwd = get_password_hash(user.password)
+    # 2. Hashear antes de abrir la sesión de escritura: bcrypt no retiene la conexión
+    hashed_pwd = await aget_password_hash(user.password)
     new_user = User(email=user.email, hashed_password=hashed_pwd)
     
-    db.add(new_user)
-    await db.commit()
-    await db.refresh(new_user)
+    # 3. Crear usuario (la restricción UNIQUE resuelve dos registros simultáneos)
+    async with async_session() as session:
+        session.add(new_user)
+        try:
+            await session.commit()
+        except IntegrityError:
+            raise HTTPException(status_code=400, detail="El email ya está registrado")
+    invalidate_user(new_user.email)
     
-    return {"message": "Usuario creado correctamente", "id": new_user.id, "email": new_user.email}
\ No newline at end of file
+    return {"message": "Usuario creado correctamente", "id": new_user.id, "email": new_user.email}
@@ -0,0 +1,103 @@
+"""Pool de backends compatibles con OpenAI para un mismo proveedor.
+
+Cada stream se envía al backend sano con menos peticiones en curso. Un
+sondeo periódico expulsa los nodos que fallan y readmite los que vuelven.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from src.config import settings
+from src.services.client_registry import client_registry
+
+
+class Backend:
+    def __init__(self, base_url: str, api_key: str):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.in_flight = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+        self.last_probe_ok = None  # Resultado del último sondeo (None = aún sin sondear)
+        self.last_probe_at = None
+
+    def stats(self) -> dict:
+        return {
+            "base_url": self.base_url,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "last_probe_ok": self.last_probe_ok,
+            "last_probe_at": self.last_probe_at.isoformat() if self.last_probe_at else None,
+        }
+
+
+class BackendPool:
+    def __init__(self, provider: str, base_urls: list, api_key: str, configured: bool = True):
+        self.provider = provider
+        self.backends = [Backend(url, api_key) for url in base_urls]
+        self.configured = configured  # False: clave de ejemplo, el proveedor no se usa en este despliegue
+        self._rotation = 0
+
+    @property
+    def monitored(self) -> bool:
+        """Se sondea si hay a dónde desviar el tráfico, tiene clave real o ya ha recibido peticiones."""
+        return len(self.backends) > 1 or self.configured or any(b.requests for b in self.backends)
+
+    def pick(self, exclude=()):
+        """Backend sano con menos peticiones en curso (o None si no queda ninguno)."""
+        candidates = [b for b in self.backends if b not in exclude]
+        healthy = [b for b in candidates if b.healthy]
+        # Si todos están expulsados, mejor intentarlo que rechazar la petición
+        candidates = healthy or candidates
+        if not candidates:
+            return None
+        # Los empates se reparten por turnos para no cargar siempre el primer nodo
+        self._rotation = (self._rotation + 1) % len(candidates)
+        candidates = candidates[self._rotation:] + candidates[:self._rotation]
+        return min(candidates, key=lambda b: b.in_flight)
+
+    def client_for(self, backend: Backend):
+        # Con varios nodos, el reintento es cambiar de nodo, no repetir en el mismo
+        max_retries = 0 if len(self.backends) > 1 else 2
+        return client_registry.get_client(self.provider, backend.base_url, backend.api_key, max_retries)
+
+    def mark_success(self, backend: Backend):
+        backend.consecutive_failures = 0
+        backend.healthy = True
+
+    def mark_failure(self, backend: Backend):
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        if backend.consecutive_failures >= settings.BACKEND_MAX_FAILURES:
+            backend.healthy = False
+
+    async def probe(self):
+        """Comprueba todos los backends con GET /models."""
+        await asyncio.gather(*(self._probe_backend(b) for b in self.backends))
+
+    async def _probe_backend(self, backend: Backend):
+        try:
+            response = await client_registry.http_client.get(
+                f"{backend.base_url.rstrip('/')}/models",
+                headers={"Authorization": f"Bearer {backend.api_key}"},
+                timeout=settings.BACKEND_HEALTH_TIMEOUT,
+            )
+            ok = response.status_code < 500
+        except Exception:
+            ok = False
+
+        if ok:
+            self.mark_success(backend)
+        else:
+            # El sondeo solo expulsa tras varios fallos seguidos, como las peticiones
+            backend.consecutive_failures += 1
+            if backend.consecutive_failures >= settings.BACKEND_MAX_FAILURES:
+                backend.healthy = False
+        backend.last_probe_ok = ok
+        backend.last_probe_at = datetime.now(timezone.utc)
+
+    def stats(self) -> list:
+        return [b.stats() for b in self.backends]
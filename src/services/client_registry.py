@@ -0,0 +1,76 @@
+"""Registro de clientes LLM de larga duración.
+
+Cada cliente (AsyncOpenAI) se crea una sola vez por proveedor/URL base y se
+reutiliza en todos los mensajes. Todos comparten un único pool de conexiones
+httpx, de modo que las conexiones TCP/TLS se mantienen vivas entre turnos.
+"""
+
+import httpx
+from src.config import settings
+
+
+class ClientRegistry:
+    def __init__(self):
+        self._http_client = None
+        self._clients = {}
+        self._created = 0
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """Cliente httpx compartido (se crea la primera vez que se usa)."""
+        if self._http_client is None or self._http_client.is_closed:
+            self._http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=settings.LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(
+                    settings.LLM_READ_TIMEOUT,
+                    connect=settings.LLM_CONNECT_TIMEOUT,
+                ),
+            )
+        return self._http_client
+
+    def get_client(self, provider: str, base_url: str = None, api_key: str = None, max_retries: int = 2) -> "AsyncOpenAI":
+        """Devuelve el cliente para (proveedor, URL base), creándolo solo la primera vez."""
+        key = (provider, base_url)
+        client = self._clients.get(key)
+        if client is None:
+            # El SDK de openai tarda ~0,5 s en importarse: se carga con el primer cliente, no al arrancar
+            from openai import AsyncOpenAI
+            client = AsyncOpenAI(
+                base_url=base_url, api_key=api_key, http_client=self.http_client, max_retries=max_retries
+            )
+            self._clients[key] = client
+            self._created += 1
+        return client
+
+    def stats(self) -> dict:
+        """Estadísticas del pool de conexiones compartido."""
+        connections = []
+        if self._http_client is not None and not self._http_client.is_closed:
+            # httpcore no expone métricas públicas; leemos el pool con cuidado
+            pool = getattr(self._http_client._transport, "_pool", None)
+            connections = list(getattr(pool, "connections", []))
+
+        idle = sum(1 for conn in connections if conn.is_idle())
+        return {
+            "clients": len(self._clients),
+            "clients_created": self._created,
+            "connections": len(connections),
+            "connections_idle": idle,
+            "connections_active": len(connections) - idle,
+            "max_connections": settings.LLM_MAX_CONNECTIONS,
+            "max_keepalive_connections": settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+        }
+
+    async def aclose(self):
+        """Cierra el pool compartido. Se llama desde el lifespan de FastAPI."""
+        self._clients.clear()
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+
+
+client_registry = ClientRegistry()
@@ -0,0 +1,99 @@
+"""Caché en memoria del contexto de cada conversación.
+
+Guarda, por conversación, los últimos mensajes ya recortados al presupuesto
+de tokens. Se amplía de forma incremental con cada mensaje nuevo, de modo
+que construir el historial para el LLM no exige releer la conversación
+completa de la DB en cada turno. Las conversaciones menos usadas se
+expulsan (LRU).
+"""
+
+from collections import OrderedDict, deque
+from src.config import settings
+from src.db.archive import rehydrate
+from src.db.crud import get_recent_messages
+from src.db.database import read_session
+from src.db.write_queue import persistence_queue
+from src.services.shared_state import shared_state
+
+
+def estimate_tokens(content: str) -> int:
+    """Estimación barata de tokens (~4 caracteres por token + coste fijo por mensaje)."""
+    return len(content) // 4 + 4
+
+
+class _ConversationContext:
+    def __init__(self):
+        self.messages = deque()  # (role, content, tokens)
+        self.tokens = 0
+
+    def append(self, role: str, content: str, budget: int):
+        tokens = estimate_tokens(content)
+        self.messages.append((role, content, tokens))
+        self.tokens += tokens
+        # Lo que no cabe en el presupuesto nunca se enviará: se descarta
+        while len(self.messages) > 1 and self.tokens > budget:
+            _, _, dropped = self.messages.popleft()
+            self.tokens -= dropped
+
+
+class ContextCache:
+    def __init__(self, max_conversations: int = None, token_budget: int = None):
+        self.max_conversations = max_conversations or settings.CONTEXT_CACHE_MAX_CONVERSATIONS
+        self.token_budget = token_budget or settings.CONTEXT_TOKEN_BUDGET
+        self._entries = OrderedDict()
+
+    def _touch(self, conversation_id: int):
+        entry = self._entries.get(conversation_id)
+        if entry is not None:
+            self._entries.move_to_end(conversation_id)
+        return entry
+
+    def _put(self, conversation_id: int, entry: _ConversationContext):
+        self._entries[conversation_id] = entry
+        self._entries.move_to_end(conversation_id)
+        while len(self._entries) > self.max_conversations:
+            self._entries.popitem(last=False)
+
+    def start(self, conversation_id: int):
+        """Registra una conversación nueva (vacía) sin ir a la DB."""
+        self._put(conversation_id, _ConversationContext())
+
+    async def warm(self, conversation_id: int):
+        """Carga desde la DB solo los mensajes recientes, si no está ya en caché."""
+        if self._touch(conversation_id) is not None:
+            return
+        # Los mensajes aún encolados también forman parte del contexto
+        await persistence_queue.wait_for(conversation_id)
+        # Retomar una conversación archivada devuelve sus mensajes a la tabla 'messages'
+        await rehydrate(conversation_id)
+        async with read_session() as session:
+            db_messages = await get_recent_messages(
+                session, conversation_id, limit=settings.CONTEXT_WARM_MESSAGES
+            )
+        entry = _ConversationContext()
+        for msg in db_messages:
+            entry.append(msg.role, msg.content or "", self.token_budget)
+        self._put(conversation_id, entry)
+
+    def append(self, conversation_id: int, role: str, content: str):
+        """Añade un mensaje al contexto (si la conversación está en caché)."""
+        entry = self._touch(conversation_id)
+        if entry is not None:
+            entry.append(role, content, self.token_budget)
+
+    async def get_history(self, conversation_id: int) -> list:
+        """Historial listo para el LLM, dentro del presupuesto de tokens."""
+        await self.warm(conversation_id)
+        entry = self._entries[conversation_id]
+        return [{"role": role, "content": content} for role, content, _ in entry.messages]
+
+    def invalidate(self, conversation_id: int):
+        """Descarta el contexto en este worker y en los demás."""
+        shared_state.invalidate("context", conversation_id)
+
+    def _drop(self, conversation_id: int):
+        self._entries.pop(conversation_id, None)
+
+
+context_cache = ContextCache()
+shared_state.register_invalidator("context", context_cache._drop)
@@ -1,28 +1,65 @@
-from openai import AsyncOpenAI
+import asyncio
+import time
+from contextlib import aclosing
+from src import metrics
 from src.config import settings
+from src.services.backend_pool import BackendPool
+from src.services.ollama_service import ollama_catalog
+from src.services.response_cache import response_cache
+
+OTHER_MODELS = "otros"  # Etiqueta común de los modelos no conocidos
+_EXAMPLE_KEY = "sk-..."  # Valor por defecto de las claves en config.py
+
+def _has_key(api_key: str) -> bool:
+    return bool(api_key) and api_key != _EXAMPLE_KEY
 
 class LLMService:
-    # ... (El método __init__ y _get_client_and_model se quedan igual) ...
     def __init__(self):
-        pass
-
-    def _get_client_and_model(self, provider: str):
-        # ... (copia tu código existente de la Fase 2 aquí) ...
-        if provider == "ollama":
-            return AsyncOpenAI(base_url=settings.OLLAMA_BASE_URL, api_key="ollama"), "llama3"
-        elif provider == "openrouter":
-            return AsyncOpenAI(base_url="[https://openrouter.ai/api/v1](https://openrouter.ai/api/v1)", api_key=settings.OPENROUTER_API_KEY), "openai/gpt-3.5-turbo"
-        elif provider == "openai":
-            return AsyncOpenAI(api_key=settings.OPENAI_API_KEY), "gpt-3.5-turbo"
-        else:
+        # Un pool de backends compatibles con OpenAI por proveedor
+        self.pools = {
+            "ollama": BackendPool("ollama", settings.ollama_base_urls, "ollama"),
+            "openrouter": BackendPool(
+                "openrouter", [settings.OPENROUTER_BASE_URL], settings.OPENROUTER_API_KEY,
+                configured=_has_key(settings.OPENROUTER_API_KEY),
+            ),
+            "openai": BackendPool(
+                "openai", [settings.OPENAI_BASE_URL], settings.OPENAI_API_KEY,
+                configured=_has_key(settings.OPENAI_API_KEY),
+            ),
+        }
+        self.default_models = {
+            "ollama": "llama3",
+            "openrouter": "openai/gpt-3.5-turbo",
+            "openai": "gpt-3.5-turbo",
+        }
+        self._health_task = None
+
+    def _get_pool_and_model(self, provider: str):
+        if provider not in self.pools:
             raise ValueError(f"Proveedor desconocido: {provider}")
+        return self.pools[provider], self.default_models[provider]
+
+    def resolve_model(self, provider: str, specific_model: str = None) -> str:
+        """Modelo que se usará realmente (el indicado o el del proveedor por defecto)."""
+        return specific_model or self.default_models.get(provider, "")
+
+    def metric_model(self, provider: str, model: str) -> str:
+        """
+        Etiqueta de modelo para métricas y colas. El nombre lo escribe el usuario:
+        solo los conocidos (por defecto o del catálogo de Ollama) tienen etiqueta propia.
+        """
+        if model == self.default_models.get(provider):
+            return model
+        if provider == "ollama" and model in ollama_catalog.models:
+            return model
+        return OTHER_MODELS
 
     # --- CAMBIO IMPORTANTE AQUÍ ---
     async def stream_response(self, history: list, provider: str, specific_model: str = None):
         """
         Ahora recibe 'history' (lista de mensajes) en lugar de solo un string.
         """
-        client, default_model = self._get_client_and_model(provider)
+        pool, default_model = self._get_pool_and_model(provider)
         model = specific_model if specific_model else default_model
 
         # Añadimos un System Prompt al inicio del historial
@@ -30,17 +67,130 @@ class LLMService:
         full_messages = [system_message] + history
 
         try:
-            stream = await client.chat.completions.create(
-                model=model,
-                messages=full_messages,
-                stream=True
-            )
-            
-            async for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
+            if response_cache.enabled:
+                # Aciertos de caché se reproducen como stream; peticiones iguales comparten llamada
+                tokens = response_cache.stream(
+                    provider, model, full_messages,
+                    lambda: self._stream_upstream(pool, model, full_messages)
+                )
+            else:
+                tokens = self._stream_upstream(pool, model, full_messages)
+
+            # aclosing: si el consumidor se va (stop/desconexión), se cierra el stream de arriba ya
+            async with aclosing(tokens):
+                # Métricas: en el bucle por token solo se cuenta; se observa al terminar
+                model_label = self.metric_model(provider, model)
+                active_streams = metrics.llm_active_streams.labels(provider, model_label)
+                active_streams.inc()
+                started_at = time.perf_counter()
+                first_token_at = None
+                chunks = 0
+                try:
+                    async for token in tokens:
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                        chunks += 1
+                        yield token
+                finally:
+                    active_streams.dec()
+                    self._observe_stream(provider, model_label, started_at, first_token_at, chunks)
 
         except Exception as e:
             yield f"\n\n**Error al conectar con {provider}:** {str(e)}"
 
+    @staticmethod
+    def _observe_stream(provider: str, model: str, started_at: float, first_token_at: float, chunks: int):
+        finished_at = time.perf_counter()
+        metrics.llm_stream_seconds.labels(provider, model).observe(finished_at - started_at)
+        if first_token_at is None:
+            return
+        metrics.llm_ttft_seconds.labels(provider, model).observe(first_token_at - started_at)
+        generation_time = finished_at - first_token_at
+        if chunks > 1 and generation_time > 0:
+            metrics.llm_tokens_per_second.labels(provider, model).observe((chunks - 1) / generation_time)
+
+    async def _stream_upstream(self, pool: BackendPool, model: str, messages: list):
+        """
+        Llamada real al proveedor. Los errores se propagan (no se cachean).
+        Si un backend falla antes del primer token, se reintenta en otro.
+        """
+        tried = set()
+        last_error = None
+        while True:
+            backend = pool.pick(exclude=tried)
+            if backend is None:
+                raise last_error
+            tried.add(backend)
+
+            client = pool.client_for(backend)
+            backend.in_flight += 1
+            backend.requests += 1
+            first_token_sent = False
+            stream = None
+            try:
+                stream = await client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    stream=True
+                )
+
+                async for chunk in stream:
+                    if chunk.choices[0].delta.content:
+                        first_token_sent = True
+                        yield chunk.choices[0].delta.content
+
+                pool.mark_success(backend)
+                return
+
+            except Exception as e:
+                status_code = getattr(e, "status_code", None)
+                if status_code is not None and status_code < 500:
+                    # Error de la petición (modelo inexistente, auth...): no es culpa del nodo
+                    raise
+                pool.mark_failure(backend)
+                if first_token_sent:
+                    # Ya se enviaron tokens al usuario: no se puede repetir en otro nodo
+                    raise
+                last_error = e
+            finally:
+                backend.in_flight -= 1
+                if stream is not None:
+                    # Cierra la respuesta HTTP: el backend deja de generar en cuanto se corta
+                    await stream.close()
+
+    # --- Sondeo de salud de los backends ---
+    def start(self):
+        if self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+
+    async def _health_loop(self):
+        # Único sitio que sondea: el estado de enrutado (healthy, fallos seguidos) no
+        # depende de cuántas veces se consulte /api/status. Los proveedores sin clave
+        # ni uso no se sondean (ni salen a Internet con una clave de ejemplo)
+        while True:
+            await asyncio.gather(*(pool.probe() for pool in self.pools.values() if pool.monitored))
+            await asyncio.sleep(settings.BACKEND_HEALTH_INTERVAL_SECONDS)
+
+    def check_backends(self) -> dict:
+        """Backends accesibles por proveedor según el último sondeo del bucle de salud (no sondea)."""
+        report = {}
+        for provider, pool in self.pools.items():
+            probed = [b.last_probe_at for b in pool.backends if b.last_probe_at]
+            report[provider] = {
+                "reachable": sum(1 for b in pool.backends if b.last_probe_ok),
+                "total": len(pool.backends),
+                "last_probe_at": max(probed).isoformat() if probed else None,
+                "monitored": pool.monitored,
+            }
+        return report
+
+    def stats(self) -> dict:
+        return {provider: pool.stats() for provider, pool in self.pools.items()}
+
 llm_service = LLMService()
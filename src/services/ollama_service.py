@@ -1,20 +1,119 @@
-import httpx
+import asyncio
+import time
 from src.config import settings
+from src.services.client_registry import client_registry
 
-async def get_ollama_models():
-    """Consulta la API de Ollama para obtener modelos disponibles."""
-    try:
-        # La URL base suele ser http://localhost:11434/v1, pero la API de tags está en /api/tags
+# Fallback si Ollama no responde
+DEFAULT_MODELS = ["llama3", "mistral"]
+
+
+class OllamaCatalog:
+    """
+    Catálogo de modelos de Ollama.
+    Cachea /api/tags y lo refresca en segundo plano; además precarga modelos
+    (keep-alive) para que el primer mensaje no pague el tiempo de carga.
+    """
+
+    def __init__(self):
+        self._models = None
+        self._fetched_at = 0.0  # Último intento (con o sin éxito); 0 = nunca
+        self._fetching = None  # Consulta en curso, compartida por quien llegue mientras tanto
+        self._refresh_task = None
+        self._warming = {}  # modelo -> tarea de precarga en curso
+
+    @property
+    def base_urls(self) -> list:
+        # La URL base suele ser http://localhost:11434/v1, pero la API nativa está en /api
         # Ajustamos la URL base quitando el /v1 si existe
-        base_url = settings.OLLAMA_BASE_URL.replace("/v1", "")
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{base_url}/api/tags")
-            if response.status_code == 200:
-                data = response.json()
-                # Extraemos solo los nombres de los modelos
-                return [model["name"] for model in data.get("models", [])]
-    except Exception as e:
-        print(f"Error conectando con Ollama: {e}")
-    
-    # Fallback si falla
-    return ["llama3", "mistral"]
\ No newline at end of file
+        return [url.replace("/v1", "") for url in settings.ollama_base_urls]
+
+    async def refresh(self) -> list:
+        """Consulta /api/tags (del primer nodo que responda) y actualiza la caché."""
+        if self._fetching is None:
+            self._fetching = asyncio.create_task(self._fetch())
+            self._fetching.add_done_callback(lambda _: setattr(self, "_fetching", None))
+        # shield: si quien espera se cancela, la consulta compartida sigue
+        await asyncio.shield(self._fetching)
+        return self.models
+
+    async def _fetch(self):
+        for base_url in self.base_urls:
+            try:
+                response = await client_registry.http_client.get(
+                    f"{base_url}/api/tags", timeout=settings.LLM_CONNECT_TIMEOUT
+                )
+                if response.status_code == 200:
+                    data = response.json()
+                    # Extraemos solo los nombres de los modelos
+                    self._models = [model["name"] for model in data.get("models", [])]
+                    break
+            except Exception as e:
+                print(f"Error conectando con Ollama ({base_url}): {e}")
+        # También se anota un fallo: hasta el próximo refresco se sirve la última lista (o DEFAULT_MODELS)
+        self._fetched_at = time.monotonic()
+
+    @property
+    def models(self) -> list:
+        return self._models if self._models else list(DEFAULT_MODELS)
+
+    async def get_models(self) -> list:
+        """
+        Modelos disponibles (de la caché). Solo se espera a Ollama si nunca se ha
+        consultado; si falló, los reintentos quedan para el refresco en segundo plano.
+        """
+        if not self._fetched_at:
+            await self.refresh()
+        return self.models
+
+    async def warm_model(self, model: str):
+        """Carga el modelo en memoria (en todos los nodos) con una petición vacía y keep-alive."""
+        await asyncio.gather(*(self._warm_on(base_url, model) for base_url in self.base_urls))
+
+    async def _warm_on(self, base_url: str, model: str):
+        try:
+            response = await client_registry.http_client.post(
+                f"{base_url}/api/generate",
+                json={"model": model, "keep_alive": settings.OLLAMA_KEEP_ALIVE},
+            )
+            if response.status_code != 200:
+                print(f"No se pudo precargar el modelo {model} en {base_url}: HTTP {response.status_code}")
+        except Exception as e:
+            print(f"No se pudo precargar el modelo {model} en {base_url}: {e}")
+
+    def schedule_warm(self, model: str):
+        """Precarga en segundo plano (sin duplicar la misma precarga en curso)."""
+        if not model or model in self._warming:
+            return
+        task = asyncio.create_task(self.warm_model(model))
+        self._warming[model] = task
+        task.add_done_callback(lambda _: self._warming.pop(model, None))
+
+    # --- Ciclo de vida ---
+    def start(self):
+        """Arranca el refresco periódico y precarga los modelos configurados."""
+        for model in settings.OLLAMA_PREWARM_MODELS.split(","):
+            self.schedule_warm(model.strip())
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        tasks = list(self._warming.values())
+        if self._refresh_task is not None:
+            tasks.append(self._refresh_task)
+            self._refresh_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _refresh_loop(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(settings.OLLAMA_MODELS_REFRESH_SECONDS)
+
+
+ollama_catalog = OllamaCatalog()
+
+
+async def get_ollama_models():
+    """Consulta la API de Ollama para obtener modelos disponibles (cacheado)."""
+    return await ollama_catalog.get_models()
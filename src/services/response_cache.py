@@ -0,0 +1,208 @@
+"""Caché de respuestas del LLM (opcional, LLM_CACHE_ENABLED).
+
+La clave es un hash de proveedor, modelo y mensajes (incluido el system
+prompt). Un acierto se reproduce como un stream de tokens, así que quien
+consume stream_response no nota la diferencia. Peticiones idénticas
+simultáneas comparten una única llamada al proveedor.
+"""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextlib import aclosing
+from src.cache import TTLCache
+from src.config import settings
+
+
+def cache_key(provider: str, model: str, messages: list) -> str:
+    payload = json.dumps(
+        {"provider": provider, "model": model, "messages": messages},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class _DiskStore:
+    """Almacén en disco (SQLite) para que la caché sobreviva a reinicios."""
+
+    def __init__(self, path: str, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, tokens TEXT NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT tokens, created_at FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] + self.ttl < now:
+                self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def set(self, key: str, tokens: list):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, tokens, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(tokens, ensure_ascii=False), now, now),
+            )
+            # Expulsión: caducados y, si sobran, los menos usados
+            self._conn.execute("DELETE FROM completions WHERE created_at < ?", (now - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM completions WHERE key IN ("
+                "SELECT key FROM completions ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _SharedStream:
+    """Una llamada al proveedor cuyos tokens pueden leer varios consumidores."""
+
+    def __init__(self, source, on_done):
+        self.tokens = []
+        self.done = False
+        self.cancelled = False
+        self.error = None
+        self._subscribers = 0
+        self._changed = asyncio.Event()
+        self._on_done = on_done
+        self._task = asyncio.create_task(self._pump(source))
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def _pump(self, source):
+        try:
+            async with aclosing(source):
+                async for token in source:
+                    self.tokens.append(token)
+                    self._notify()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+            self._on_done(self)
+
+    async def subscribe(self):
+        self._subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(self.tokens):
+                    yield self.tokens[index]
+                    index += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                changed = self._changed
+                await changed.wait()
+        finally:
+            self._subscribers -= 1
+            # Si ya nadie lee, no tiene sentido seguir generando
+            if self._subscribers == 0 and not self.done:
+                self._task.cancel()
+
+
+class ResponseCache:
+    def __init__(self):
+        self.enabled = settings.LLM_CACHE_ENABLED
+        self._memory = TTLCache(max_size=settings.LLM_CACHE_MAX_ENTRIES, ttl=settings.LLM_CACHE_TTL_SECONDS)
+        self._disk = None
+        if self.enabled and settings.LLM_CACHE_DISK_PATH:
+            self._disk = _DiskStore(
+                settings.LLM_CACHE_DISK_PATH,
+                ttl=settings.LLM_CACHE_TTL_SECONDS,
+                max_entries=settings.LLM_CACHE_DISK_MAX_ENTRIES,
+            )
+        self._inflight = {}
+        self.coalesced = 0
+
+    async def stream(self, provider: str, model: str, messages: list, upstream):
+        """
+        Devuelve los tokens de la respuesta: de la caché si existe, si no de
+        'upstream()' (compartido con peticiones idénticas en curso).
+        """
+        key = cache_key(provider, model, messages)
+
+        tokens = self._memory.get(key)
+        if tokens is None and self._disk is not None:
+            tokens = await asyncio.to_thread(self._disk.get, key)
+            if tokens is not None:
+                self._memory.set(key, tokens)
+        if tokens is not None:
+            for token in tokens:
+                yield token
+            return
+
+        shared = self._inflight.get(key)
+        if shared is None:
+            shared = _SharedStream(upstream(), on_done=lambda s: self._finish(key, s))
+            self._inflight[key] = shared
+        else:
+            self.coalesced += 1
+
+        subscription = shared.subscribe()
+        try:
+            async for token in subscription:
+                yield token
+        finally:
+            await subscription.aclose()
+            if shared._subscribers == 0 and self._inflight.get(key) is shared:
+                del self._inflight[key]
+
+    def _finish(self, key: str, shared: _SharedStream):
+        if self._inflight.get(key) is shared:
+            del self._inflight[key]
+        # Solo se guardan respuestas completas y sin error
+        if shared.error is None and not shared.cancelled and shared.tokens:
+            tokens = list(shared.tokens)
+            self._memory.set(key, tokens)
+            if self._disk is not None:
+                asyncio.get_running_loop().run_in_executor(None, self._disk.set, key, tokens)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "memory": self._memory.stats(),
+            "inflight": len(self._inflight),
+            "coalesced": self.coalesced,
+            "disk": bool(self._disk),
+        }
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+
+
+response_cache = ResponseCache()
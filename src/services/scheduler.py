@@ -0,0 +1,249 @@
+"""Control de admisión y reparto justo de streams LLM.
+
+Cada (proveedor, modelo) tiene un límite de streams simultáneos y, si se
+configura, el proveedor tiene además un límite común a todos sus modelos
+(SCHED_LIMITS="ollama=4"). Lo que no cabe espera en una cola acotada que se
+reparte por turnos entre usuarios (round-robin), de modo que un usuario con
+muchas peticiones no deja sin servicio a los demás. Si la cola está llena, la
+petición se rechaza.
+
+El nombre del modelo lo escribe el usuario: solo los modelos conocidos tienen
+cola (y etiqueta de métricas) propia; el resto comparten la de "otros".
+"""
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from src import metrics
+from src.config import settings
+from src.services.llm_service import OTHER_MODELS, llm_service
+
+
+class QueueFullError(Exception):
+    """La cola de espera de ese proveedor/modelo está llena."""
+
+
+class _Waiter:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+
+
+class _Provider:
+    def __init__(self, limit: int = None):
+        self.limit = limit  # None = sin límite común (solo el de cada modelo)
+        self.active = 0
+        self.lanes = []
+
+    @property
+    def full(self) -> bool:
+        return self.limit is not None and self.active >= self.limit
+
+
+class _Lane:
+    def __init__(self, key: tuple, provider: _Provider, limit: int, max_queue: int):
+        self.key = key
+        self.provider = provider
+        self.wait_metric = metrics.llm_queue_wait_seconds.labels(*key)
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self.queues = OrderedDict()  # usuario -> deque de _Waiter, en orden de turno
+        self.size = 0
+
+    def enqueue(self, waiter: _Waiter):
+        self.queues.setdefault(waiter.user_id, deque()).append(waiter)
+        self.size += 1
+
+    def remove(self, waiter: _Waiter):
+        queue = self.queues.get(waiter.user_id)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            self.size -= 1
+            if not queue:
+                del self.queues[waiter.user_id]
+
+    def pop_next(self):
+        """Siguiente en espera: primero del usuario al que le toca turno."""
+        if not self.queues:
+            return None
+        user_id, queue = next(iter(self.queues.items()))
+        waiter = queue.popleft()
+        self.size -= 1
+        del self.queues[user_id]
+        if queue:
+            # El usuario pasa al final de la ronda
+            self.queues[user_id] = queue
+        return waiter
+
+    def position(self, waiter: _Waiter) -> int:
+        """Posición (1 = el siguiente) según el orden round-robin actual."""
+        users = list(self.queues.keys())
+        if waiter.user_id not in self.queues:
+            return 0
+        own_index = users.index(waiter.user_id)
+        k = self.queues[waiter.user_id].index(waiter)
+        ahead = k
+        for i, user_id in enumerate(users):
+            if user_id == waiter.user_id:
+                continue
+            # Los usuarios anteriores en la ronda salen una vez más antes que nosotros
+            rounds = k + 1 if i < own_index else k
+            ahead += min(len(self.queues[user_id]), rounds)
+        return ahead + 1
+
+
+class StreamScheduler:
+    def __init__(self):
+        self._lanes = {}
+        self._providers = {}
+        self._limits = self._parse_limits(settings.SCHED_LIMITS)
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    @staticmethod
+    def _parse_limits(spec: str) -> dict:
+        """'ollama=4,openai:gpt-4=2' -> {('ollama', None): 4, ('openai', 'gpt-4'): 2}"""
+        limits = {}
+        for item in spec.split(","):
+            if "=" not in item:
+                continue
+            target, value = item.split("=", 1)
+            provider, _, model = target.strip().partition(":")
+            limits[(provider, model or None)] = int(value)
+        return limits
+
+    def _lane_key(self, provider: str, model: str) -> tuple:
+        """(proveedor, modelo) con cardinalidad acotada: lo desconocido va a "otros"."""
+        if provider not in llm_service.pools:
+            return (OTHER_MODELS, OTHER_MODELS)
+        if (provider, model) in self._limits:
+            return (provider, model)
+        return (provider, llm_service.metric_model(provider, model))
+
+    def _lane(self, provider: str, model: str) -> _Lane:
+        key = self._lane_key(provider, model)
+        lane = self._lanes.get(key)
+        if lane is None:
+            group = self._providers.get(key[0])
+            if group is None:
+                group = _Provider(self._limits.get((key[0], None)))
+                self._providers[key[0]] = group
+            limit = self._limits.get(key, settings.SCHED_MAX_CONCURRENT_STREAMS)
+            lane = _Lane(key, group, limit, settings.SCHED_MAX_QUEUE)
+            group.lanes.append(lane)
+            self._lanes[key] = lane
+        return lane
+
+    @asynccontextmanager
+    async def slot(self, provider: str, model: str, user_id, on_position=None):
+        """
+        Reserva un hueco para un stream. Mientras espera, llama a
+        'on_position(posición)' cada vez que su posición en la cola cambia.
+        Lanza QueueFullError si la cola está llena.
+        """
+        lane = self._lane(provider, model)
+        if lane.active < lane.limit and not lane.provider.full and lane.size == 0:
+            self._start(lane)
+            self._record_wait(lane, 0.0)
+        else:
+            await self._wait_for_turn(lane, user_id, on_position)
+
+        try:
+            yield
+        finally:
+            self._release(lane)
+
+    async def _wait_for_turn(self, lane: _Lane, user_id, on_position):
+        if lane.size >= lane.max_queue:
+            self.rejected += 1
+            _rejected_total.labels(*lane.key).inc()
+            raise QueueFullError("Demasiadas peticiones en cola; inténtalo de nuevo en unos segundos.")
+
+        waiter = _Waiter(user_id)
+        lane.enqueue(waiter)
+        last_position = None
+        try:
+            while not waiter.future.done():
+                position = lane.position(waiter)
+                if on_position and position != last_position:
+                    last_position = position
+                    await on_position(position)
+                await asyncio.wait({waiter.future}, timeout=settings.SCHED_POSITION_UPDATE_SECONDS)
+        except BaseException:
+            if waiter.future.done():
+                # Se nos concedió el hueco justo al cancelar: se devuelve
+                self._release(lane)
+            else:
+                lane.remove(waiter)
+                waiter.future.cancel()
+            raise
+        self._record_wait(lane, time.monotonic() - waiter.enqueued_at)
+
+    @staticmethod
+    def _start(lane: _Lane):
+        lane.active += 1
+        lane.provider.active += 1
+
+    def _release(self, lane: _Lane):
+        lane.active -= 1
+        lane.provider.active -= 1
+        # El hueco puede ser de otro modelo del mismo proveedor si solo esperaba por el límite común
+        provider = lane.provider
+        granted = True
+        while granted and not provider.full:
+            granted = False
+            for candidate in provider.lanes:
+                if provider.full:
+                    break
+                if candidate.active < candidate.limit and self._grant_next(candidate):
+                    granted = True
+
+    def _grant_next(self, lane: _Lane) -> bool:
+        """Da el hueco al siguiente en turno de la cola (False si no queda nadie)."""
+        while True:
+            waiter = lane.pop_next()
+            if waiter is None:
+                return False
+            if waiter.future.done():
+                continue
+            self._start(lane)
+            waiter.future.set_result(None)
+            return True
+
+    def _record_wait(self, lane: _Lane, seconds: float):
+        lane.wait_metric.observe(seconds)
+        self.admitted += 1
+        self.wait_seconds_total += seconds
+        self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def stats(self) -> dict:
+        return {
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_seconds_avg": round(self.wait_seconds_total / self.admitted, 4) if self.admitted else 0.0,
+            "wait_seconds_max": round(self.wait_seconds_max, 4),
+            "lanes": {
+                f"{provider}:{model}": {"active": lane.active, "limit": lane.limit, "queued": lane.size}
+                for (provider, model), lane in self._lanes.items()
+            },
+            "providers": {
+                provider: {"active": group.active, "limit": group.limit}
+                for provider, group in self._providers.items()
+            },
+        }
+
+
+stream_scheduler = StreamScheduler()
+
+_rejected_total = metrics.Counter(
+    "llm_queue_rejected_total", "Peticiones rechazadas por cola llena", ("provider", "model")
+)
+metrics.Gauge(
+    "llm_queue_depth", "Peticiones esperando turno", ("provider", "model"),
+    collect=lambda: {key: lane.size for key, lane in stream_scheduler._lanes.items()}
+)
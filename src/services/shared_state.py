@@ -0,0 +1,207 @@
+"""Estado compartido entre workers (varios procesos de uvicorn).
+
+Guarda lo que hoy vive en cl.user_session y debe sobrevivir a que la sesión
+cambie de proceso (conversación activa y ajustes), y reparte las
+invalidaciones de caché a todos los workers.
+
+Backends (SHARED_STATE_BACKEND):
+  - "local": en memoria del proceso. Es el comportamiento de siempre, para un solo worker.
+  - "sqlite": un fichero SQLite en la misma máquina (WAL). Las invalidaciones
+    se publican en una tabla de eventos que cada worker sondea.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from src.cache import TTLCache
+from src.config import settings
+
+
+class LocalSharedState:
+    """Un solo proceso: estado en memoria e invalidaciones solo locales."""
+
+    backend = "local"
+
+    def __init__(self):
+        self._data = TTLCache(max_size=settings.SHARED_STATE_MAX_KEYS, ttl=settings.SHARED_STATE_TTL_SECONDS)
+        self._invalidators = {}
+        self.invalidations_sent = 0
+        self.invalidations_received = 0
+
+    # --- Clave/valor ---
+    async def get(self, namespace: str, key: str, default=None):
+        return self._data.get((namespace, key), default)
+
+    async def set(self, namespace: str, key: str, value):
+        self._data.set((namespace, key), value)
+
+    async def delete(self, namespace: str, key: str):
+        self._data.pop((namespace, key))
+
+    # --- Invalidaciones ---
+    def register_invalidator(self, cache: str, callback):
+        """'callback(clave)' descarta la entrada de esa caché en este proceso."""
+        self._invalidators[cache] = callback
+
+    def invalidate(self, cache: str, key):
+        """Descarta la entrada en este worker y la anuncia a los demás."""
+        self._apply(cache, key)
+        self._publish(cache, key)
+
+    def _apply(self, cache: str, key):
+        callback = self._invalidators.get(cache)
+        if callback is not None:
+            callback(key)
+
+    def _publish(self, cache: str, key):
+        pass
+
+    # --- Ciclo de vida ---
+    def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "invalidations_sent": self.invalidations_sent,
+            "invalidations_received": self.invalidations_received,
+        }
+
+
+class SQLiteSharedState(LocalSharedState):
+    """Varios procesos en una máquina: claves y eventos en un fichero SQLite."""
+
+    backend = "sqlite"
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.origin = uuid.uuid4().hex  # Para ignorar nuestros propios eventos
+        self._conn = None
+        self._lock = threading.Lock()
+        self._last_event_id = 0
+        self._poll_task = None
+        self._pending = set()
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={settings.DB_SQLITE_BUSY_TIMEOUT_MS}")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                "namespace TEXT, key TEXT, value TEXT, expires_at REAL, PRIMARY KEY (namespace, key))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT, cache TEXT, key TEXT, created_at REAL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql: str, params=()):
+        # Una conexión por proceso; las llamadas llegan desde hilos del pool
+        with self._lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    async def _run(self, sql: str, params=()):
+        return await asyncio.to_thread(self._execute, sql, params)
+
+    # --- Clave/valor ---
+    async def get(self, namespace: str, key: str, default=None):
+        rows = await self._run(
+            "SELECT value FROM kv WHERE namespace = ? AND key = ? AND expires_at > ?",
+            (namespace, key, time.time()),
+        )
+        return json.loads(rows[0][0]) if rows else default
+
+    async def set(self, namespace: str, key: str, value):
+        await self._run(
+            "INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, json.dumps(value), time.time() + settings.SHARED_STATE_TTL_SECONDS),
+        )
+
+    async def delete(self, namespace: str, key: str):
+        await self._run("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+
+    # --- Invalidaciones ---
+    def _publish(self, cache: str, key):
+        self.invalidations_sent += 1
+        params = (self.origin, cache, json.dumps(key), time.time())
+        sql = "INSERT INTO events (origin, cache, key, created_at) VALUES (?, ?, ?, ?)"
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Fuera del event loop (scripts): escritura directa
+            self._execute(sql, params)
+            return
+        # No se espera a la escritura; se guarda la tarea para que no la recoja el GC
+        task = asyncio.create_task(self._run(sql, params))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _poll_loop(self):
+        interval = settings.SHARED_STATE_POLL_MS / 1000
+        last_cleanup = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                rows = await self._run(
+                    "SELECT id, origin, cache, key FROM events WHERE id > ? ORDER BY id",
+                    (self._last_event_id,),
+                )
+                for event_id, origin, cache, key in rows:
+                    self._last_event_id = event_id
+                    if origin != self.origin:
+                        self.invalidations_received += 1
+                        self._apply(cache, json.loads(key))
+
+                if time.monotonic() - last_cleanup > settings.SHARED_STATE_EVENT_TTL_SECONDS:
+                    last_cleanup = time.monotonic()
+                    now = time.time()
+                    await self._run("DELETE FROM events WHERE created_at < ?", (now - settings.SHARED_STATE_EVENT_TTL_SECONDS,))
+                    await self._run("DELETE FROM kv WHERE expires_at < ?", (now,))
+            except Exception as e:
+                print(f"Error sondeando el estado compartido: {e}")
+
+    # --- Ciclo de vida ---
+    def start(self):
+        if self._poll_task is None:
+            # Solo interesan los eventos a partir de ahora
+            rows = self._execute("SELECT COALESCE(MAX(id), 0) FROM events")
+            self._last_event_id = rows[0][0]
+            self._poll_task = asyncio.create_task(self._poll_loop())
+
+    async def stop(self):
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            await asyncio.gather(self._poll_task, return_exceptions=True)
+            self._poll_task = None
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def stats(self) -> dict:
+        return {**super().stats(), "last_event_id": self._last_event_id}
+
+
+def _create_shared_state():
+    if settings.SHARED_STATE_BACKEND == "sqlite":
+        return SQLiteSharedState(settings.SHARED_STATE_PATH)
+    if settings.WEB_CONCURRENCY > 1:
+        print("Aviso: WEB_CONCURRENCY > 1 con SHARED_STATE_BACKEND=local; las sesiones no se comparten entre workers.")
+    return LocalSharedState()
+
+
+shared_state = _create_shared_state()
@@ -0,0 +1,81 @@
+"""Agrupación de tokens para el streaming de respuestas.
+
+En lugar de enviar un frame de socket.io por cada token del proveedor,
+los tokens se acumulan y se envían juntos cuando pasa una ventana de tiempo
+o cuando el bloque pendiente alcanza un tamaño máximo. Si el proveedor hace
+una pausa, un temporizador envía lo pendiente al cumplirse la ventana.
+"""
+
+import asyncio
+import time
+from src.config import settings
+
+
+class TokenCoalescer:
+    def __init__(self, send, flush_interval_ms: int = None, max_chars: int = None):
+        """
+        'send' es la corrutina que emite un bloque de texto (p. ej. msg.stream_token).
+        Si no se indican, los límites se toman de la configuración.
+        """
+        self._send = send
+        if flush_interval_ms is None:
+            flush_interval_ms = settings.STREAM_FLUSH_INTERVAL_MS
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_chars = max_chars if max_chars is not None else settings.STREAM_FLUSH_MAX_CHARS
+
+        self._parts = []    # Todo el texto recibido (se une una sola vez al final)
+        self._pending = []  # Tokens aún no enviados
+        self._pending_chars = 0
+        self._last_flush = None
+        self._timer = None  # Tarea que envía lo pendiente si no llegan más tokens
+        self._send_lock = asyncio.Lock()  # Los frames salen en orden aunque se solapen envíos
+        self.frames = 0
+
+    async def feed(self, token: str):
+        """Añade un token y envía el bloque pendiente si toca."""
+        if not token:
+            return
+        self._parts.append(token)
+        self._pending.append(token)
+        self._pending_chars += len(token)
+
+        now = time.monotonic()
+        # El primer token sale enseguida para no retrasar el time-to-first-token
+        if (
+            self._last_flush is None
+            or self._pending_chars >= self.max_chars
+            or now - self._last_flush >= self.flush_interval
+        ):
+            await self.flush(now)
+        elif self._timer is None:
+            delay = self.flush_interval - (now - self._last_flush)
+            self._timer = asyncio.create_task(self._flush_after(delay))
+
+    async def _flush_after(self, delay: float):
+        await asyncio.sleep(delay)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self, now: float = None):
+        """Envía lo pendiente como un único frame."""
+        self.cancel()
+        if not self._pending:
+            return
+        chunk = "".join(self._pending)
+        self._pending.clear()
+        self._pending_chars = 0
+        self._last_flush = now if now is not None else time.monotonic()
+        self.frames += 1
+        async with self._send_lock:
+            await self._send(chunk)
+
+    def cancel(self):
+        """Anula el envío programado (al cancelar el stream o antes del último flush)."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    @property
+    def text(self) -> str:
+        """Texto completo recibido hasta ahora."""
+        return "".join(self._parts)
@@ -0,0 +1,38 @@
+"""Informe de tiempos de arranque: cuánto cuesta cada fase de import e inicialización."""
+
+import time
+
+
+class StartupReport:
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self._last = self.started_at
+        self.phases = []  # (nombre, segundos)
+        self.ready = False
+
+    def mark(self, name: str):
+        """Cierra una fase: el tiempo desde la marca anterior se atribuye a 'name'."""
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def finish(self):
+        self.ready = True
+        print(self.render())
+
+    def render(self) -> str:
+        total = sum(seconds for _, seconds in self.phases)
+        lines = [f"Arranque en {total * 1000:.0f} ms:"]
+        for name, seconds in self.phases:
+            lines.append(f"  {name:<28} {seconds * 1000:8.1f} ms")
+        return "\n".join(lines)
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "total_ms": round(sum(seconds for _, seconds in self.phases) * 1000, 1),
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases},
+        }
+
+
+startup_report = StartupReport()